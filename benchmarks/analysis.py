@@ -0,0 +1,235 @@
+"""Time the statistics functions on synthetic feature tables of increasing size.
+
+Tables are modelled on example-data/FeatureMatrix.csv and MetaData.txt (MZmine quantification
+table with "row ID", "row m/z", "row retention time" and "<file>.mzML Peak area" columns, meta
+data with a "filename" column) and prepared like the Data Preparation page (half-minimum
+imputation, center-scaling). Every function runs with empty Streamlit caches and an empty
+(temporary) result store; the run time is the best of --repeat runs, peak memory is measured in
+an extra run with tracemalloc (allocations of worker processes are not included).
+
+Run from the repository root:
+
+    python -m benchmarks.analysis --features 1000 10000 --samples 24 96 --out benchmark
+    python -m benchmarks.analysis --features 1000 10000 --samples 24 96 --compare benchmark.json
+
+Results are written to <out>.json (with versions and git commit) and <out>.csv.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.logger import set_log_level
+
+from src import diskcache
+from src.common import get_metabolite_index
+from src.cleanup import prepare_data
+from src.anova import anova, tukey
+from src.kruskal import kruskal_wallis, dunn
+from src.ttest import gen_ttest_data
+from src.pcoa import permanova_pcoa
+from src.clustering import get_heatmap
+from src.pca import get_pca_df
+from src.randomforest import run_random_forest
+from src.dataset import AnalysisDataset
+
+
+def gen_quantification_table(n_features, n_samples, n_groups=2, zero_fraction=0.5, effect_fraction=0.1, seed=0):
+    """Synthetic MZmine quantification table and meta data with n_groups sample groups.
+
+    A fraction of the features differs between the groups, a fraction of all intensities is missing (0).
+    """
+    rng = np.random.default_rng(seed)
+    files = [f"sample_{i}.mzML" for i in range(n_samples)]
+    groups = np.arange(n_samples) % n_groups
+
+    # log-normal peak areas, shifted per group for the first features
+    log_areas = rng.normal(12, 2, (n_features, 1)) + rng.normal(0, 0.5, (n_features, n_samples))
+    n_effect = int(n_features * effect_fraction)
+    log_areas[:n_effect] += rng.normal(0, 1.5, (n_effect, n_groups))[:, groups]
+    areas = np.exp(log_areas)
+    areas[rng.random(areas.shape) < zero_fraction] = 0
+
+    ft = pd.DataFrame(
+        {
+            "row ID": np.arange(1, n_features + 1),
+            "row m/z": rng.uniform(100, 1500, n_features),
+            "row retention time": rng.uniform(0, 30, n_features),
+        }
+    )
+    ft = pd.concat([ft, pd.DataFrame(areas, columns=[f"{f} Peak area" for f in files])], axis=1)
+
+    md = pd.DataFrame(
+        {
+            "Sample": [f"S{i // 2}" for i in range(n_samples)],
+            "Sample_Type": "Sample",
+            "Group": [f"G{g + 1}" for g in groups],
+        },
+        index=pd.Index(files, name="filename"),
+    )
+    return ft, md
+
+
+def prepare(ft, md):
+    # same index as the File Selection page
+    ft.index = get_metabolite_index(ft["row m/z"], ft["row retention time"], ft["row ID"])
+    md, data = prepare_data(ft, md, imputation="half-minimum", normalization_method="Center-Scaling")
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    return data, md
+
+
+def get_benchmarks(data, md, attribute="Group"):
+    """Functions to time, each takes no arguments; results of previous steps are computed beforehand."""
+    labels = md[attribute]
+    groups = sorted(labels.unique())[:2]
+    dataset = AnalysisDataset(data, md)
+    df_anova = anova(dataset, attribute, "fdr_bh")
+    df_kruskal = kruskal_wallis(dataset, attribute, "fdr_bh")
+    return {
+        "anova": lambda: anova(dataset, attribute, "fdr_bh"),
+        "tukey": lambda: tukey(dataset, df_anova, attribute, groups, "fdr_bh"),
+        "gen_ttest_data": lambda: gen_ttest_data(dataset, attribute, groups, False, "two-sided", "auto", "fdr_bh"),
+        "kruskal_wallis": lambda: kruskal_wallis(dataset, attribute, "fdr_bh"),
+        "dunn": lambda: dunn(dataset, df_kruskal, attribute, groups, "fdr_bh"),
+        "permanova_pcoa": lambda: permanova_pcoa(dataset, "braycurtis", attribute, 999, 123),
+        # page default of at most 5000 features
+        "get_heatmap": lambda: get_heatmap(dataset, "euclidean", "complete", 5000),
+        "get_pca_df": lambda: get_pca_df(dataset, 5),
+        "run_random_forest": lambda: run_random_forest(dataset, attribute, 100, 123, 1),
+    }
+
+
+def clear_caches():
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    diskcache.clear_result_store()
+
+
+def measure(func, repeat=3):
+    """Best run time (s), CPU time of that run (s) and peak traced memory (MiB), always with empty caches."""
+    times = []
+    for _ in range(repeat):
+        clear_caches()
+        wall, cpu = time.perf_counter(), time.process_time()
+        func()
+        times.append((time.perf_counter() - wall, time.process_time() - cpu))
+
+    clear_caches()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    wall, cpu = min(times)
+    return wall, cpu, peak / 1024**2
+
+
+def get_environment():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import scipy
+    import sklearn
+
+    return {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "scipy": scipy.__version__,
+        "scikit-learn": sklearn.__version__,
+        "streamlit": st.__version__,
+    }
+
+
+def run(features, samples, groups, zero_fractions, functions=None, repeat=3):
+    """Time the functions for every combination of table size, yields one result dict per function and size."""
+    for n_features, n_samples, n_groups, zero_fraction in itertools.product(features, samples, groups, zero_fractions):
+        data, md = prepare(*gen_quantification_table(n_features, n_samples, n_groups, zero_fraction))
+        for name, func in get_benchmarks(data, md).items():
+            if functions and name not in functions:
+                continue
+            try:
+                wall, cpu, peak = measure(func, repeat)
+                error = None
+            except Exception as e:
+                wall, cpu, peak, error = np.nan, np.nan, np.nan, f"{type(e).__name__}: {e}"
+            yield {
+                "function": name,
+                "features": n_features,
+                "samples": n_samples,
+                "groups": n_groups,
+                "zero fraction": zero_fraction,
+                "time (s)": wall,
+                "cpu time (s)": cpu,
+                "peak memory (MiB)": peak,
+                "error": error,
+            }
+
+
+def compare(df, previous):
+    """Run time and peak memory relative to a previous report (values > 1 are slower / use more memory)."""
+    keys = ["function", "features", "samples", "groups", "zero fraction"]
+    df = df.merge(previous, on=keys, suffixes=("", " previous"))
+    return df.assign(
+        **{
+            "time ratio": df["time (s)"] / df["time (s) previous"],
+            "memory ratio": df["peak memory (MiB)"] / df["peak memory (MiB) previous"],
+        }
+    )[keys + ["time (s) previous", "time (s)", "time ratio", "memory ratio"]]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--features", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--samples", type=int, nargs="+", default=[24, 96])
+    parser.add_argument("--groups", type=int, nargs="+", default=[3])
+    parser.add_argument("--zero-fraction", type=float, nargs="+", default=[0.5])
+    parser.add_argument("--functions", nargs="+", help="only time these functions")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--out", default="benchmark", help="report file name without extension")
+    parser.add_argument("--compare", help="previous JSON report to compare with")
+    args = parser.parse_args(args)
+
+    set_log_level("error")
+    # results are stored in a temporary directory, not in the result store of the app
+    tmp = tempfile.TemporaryDirectory()
+    diskcache.RESULT_CACHE_DIR = Path(tmp.name)
+    diskcache.RESULT_INDEX = diskcache.RESULT_CACHE_DIR / "index.sqlite"
+    results = []
+    for result in run(args.features, args.samples, args.groups, args.zero_fraction, args.functions, args.repeat):
+        print(
+            f"{result['function']:>18} {result['features']:>7} features {result['samples']:>5} samples "
+            f"{result['time (s)']:>9.3f} s {result['peak memory (MiB)']:>9.1f} MiB"
+            + (f"  {result['error']}" if result["error"] else "")
+        )
+        results.append(result)
+
+    df = pd.DataFrame(results)
+    df.to_csv(f"{args.out}.csv", index=False)
+    with open(f"{args.out}.json", "w") as f:
+        json.dump({"environment": get_environment(), "results": results}, f, indent=2, default=str)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = pd.DataFrame(json.load(f)["results"])
+        print(compare(df, previous).to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
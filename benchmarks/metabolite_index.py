@@ -0,0 +1,66 @@
+"""Compare the metabolite index construction with the previous row-wise and Series based approaches.
+
+Run from the repository root: python -m benchmarks.metabolite_index
+"""
+import timeit
+
+import numpy as np
+import pandas as pd
+
+from src.common import get_metabolite_index
+
+
+def gen_quantification_table(n_features, n_samples=10, seed=0):
+    rng = np.random.default_rng(seed)
+    ft = pd.DataFrame(
+        {
+            "row ID": np.arange(1, n_features + 1),
+            "row m/z": rng.uniform(100, 1500, n_features),
+            "row retention time": rng.uniform(0, 30, n_features),
+        }
+    )
+    for i in range(n_samples):
+        ft[f"sample_{i}.mzML Peak area"] = rng.lognormal(10, 2, n_features)
+    # a text column, like in GNPS exports, keeps row IDs as integers in row-wise apply
+    ft["Compound_Name"] = "unknown"
+    return ft
+
+
+def gnps_apply(ft):
+    return ft.apply(
+        lambda x: f'{x["row ID"]}_{round(x["row m/z"], 4)}_{round(x["row retention time"], 2)}', axis=1
+    )
+
+
+def gnps_vectorized(ft):
+    return get_metabolite_index(ft["row m/z"], ft["row retention time"], ft["row ID"], mz_decimals=4, sep="_")
+
+
+def series_concat(ft):
+    return (
+        ft["row ID"].astype(str)
+        + "_"
+        + ft["row m/z"].round(5).astype(str)
+        + "@"
+        + ft["row retention time"].round(2).astype(str)
+    )
+
+
+def vectorized(ft):
+    return get_metabolite_index(ft["row m/z"], ft["row retention time"], ft["row ID"])
+
+
+def time_it(func, ft, repeat=3):
+    return min(timeit.repeat(lambda: func(ft), number=1, repeat=repeat))
+
+
+if __name__ == "__main__":
+    print(f"{'features':>10} {'GNPS apply':>12} {'GNPS new':>12} {'concat':>12} {'new':>12}  (seconds)")
+    for n_features in (1000, 10000, 50000):
+        ft = gen_quantification_table(n_features)
+        assert (gnps_apply(ft).to_numpy() == gnps_vectorized(ft).to_numpy()).all()
+        assert (series_concat(ft).to_numpy() == vectorized(ft).to_numpy()).all()
+        print(
+            f"{n_features:>10} {time_it(gnps_apply, ft):>12.4f} {time_it(gnps_vectorized, ft):>12.4f} "
+            f"{time_it(series_concat, ft):>12.4f} {time_it(vectorized, ft):>12.4f}"
+        )
@@ -2,6 +2,7 @@ import streamlit as st
 from src.common import *
 from src.fileselection import *
 from src.cleanup import *
+from src.dataset import *
 import pandas as pd
 
 page_setup()
@@ -110,6 +111,11 @@ else:
             st.image("assets/figures/scaling.png")
 
 
+        # the submitted data is prepared from the loaded tables with the options selected below,
+        # with the same function as the batch pipeline (prepare_data)
+        loaded_ft, loaded_md = ft, md
+        options = {}
+
         # clean up meta data table
         md = clean_up_md(md)
 
@@ -154,7 +160,7 @@ else:
                 samples_md = md.loc[samples.columns]
 
                 with st.expander(f"Selected samples preview (n={samples.shape[1]})"):
-                    st.dataframe(samples.head())
+                    st.dataframe(to_dense(samples.head()))
 
                 if samples.shape[1] == ft.shape[1]:
                     st.warning("You selected everything as sample type. Blank removal not possible.")
@@ -181,7 +187,7 @@ else:
                     blank_rows = c2.multiselect("blank selection", blank_options, blank_options[0])
                     blanks = ft[non_samples_md[non_samples_md[blank_column].isin(blank_rows)].index]
                     with st.expander(f"Selected blanks preview (n={blanks.shape[1]})"):
-                        st.dataframe(blanks.head())
+                        st.dataframe(to_dense(blanks.head()))
 
                     # define a cutoff value for blank removal (ratio blank/avg(samples))
                     c1, c2 = st.columns(2)
@@ -200,9 +206,16 @@ else:
                         n_background_features,
                         n_real_features,
                     ) = remove_blank_features(blanks, samples, cutoff)
+                    options.update(
+                        sample_attribute=sample_column,
+                        samples=sample_rows,
+                        blank_attribute=blank_column,
+                        blanks=blank_rows,
+                        blank_cutoff=cutoff,
+                    )
                     c2.metric("background or noise features", n_background_features)
                     with st.expander(f"Feature table after removing blanks - features: {ft.shape[0]}, samples: {ft.shape[1]}"):
-                        show_table(ft, "blank-features-removed")
+                        show_table(to_dense(ft), "blank-features-removed")
             
                 st.session_state['blank_removal_done'] = True
             else:
@@ -216,17 +229,35 @@ else:
                     c1, c2 = st.columns(2)
                     c2.metric(
                         f"total missing values",
-                        str((ft == 0).to_numpy().mean() * 100)[:4] + " %",
+                        str(get_missing_fraction(ft) * 100)[:4] + " %",
                     )
-                    imputation = c1.checkbox("Impute missing values?", False, help=f"These values will be filled with random number between 1 and {cutoff_LOD} (Limit of Detection) during imputation.")
+                    imputation = c1.checkbox("Impute missing values?", False, help=f"Missing values (0) will be filled using the selected method, by default with random numbers between 1 and {cutoff_LOD} (Limit of Detection).")
                     if imputation:
-                        if cutoff_LOD > 1:
-                            c1, c2 = st.columns(2)
-                            ft = impute_missing_values(ft, cutoff_LOD)
+                        c1, c2 = st.columns(2)
+                        imputation_method = imputation_methods[
+                            c1.selectbox("imputation method", imputation_methods.keys())
+                        ]
+                        if imputation_method == "random":
+                            imputation_seed = c2.number_input("random seed", 0, None, 123, help="Fixed seed to make the random imputation reproducible.")
+                        if imputation_method == "KNN":
+                            n_neighbors = c2.number_input("number of neighbours", 1, max(1, ft.shape[1] - 1), min(5, max(1, ft.shape[1] - 1)))
+                        if imputation_method == "random" and cutoff_LOD <= 1:
+                            st.warning(f"Can't impute with random values between 1 and lowest value, which is {cutoff_LOD} (rounded).")
+                        else:
+                            options.update(
+                                imputation=imputation_method,
+                                seed=imputation_seed if imputation_method == "random" else None,
+                                n_neighbors=n_neighbors if imputation_method == "KNN" else 5,
+                            )
+                            ft = impute_missing_values(
+                                ft,
+                                cutoff_LOD,
+                                imputation_method,
+                                seed=options["seed"],
+                                n_neighbors=options["n_neighbors"],
+                            )
                             with st.expander(f"Imputed data - features: {ft.shape[0]}, samples: {ft.shape[1]}"):
                                 show_table(ft.head(), "imputed")
-                        else:
-                            st.warning(f"Can't impute with random values between 1 and lowest value, which is {cutoff_LOD} (rounded).")
                         
                         st.session_state['imputation_done'] = True
                     else:
@@ -238,6 +269,7 @@ else:
                                                             # "Probabilistic Quotient Normalization (PQN)", 
                                                             "Total Ion Current (TIC) or sample-centric normalization"])
                     st.session_state['normalization_method_used'] = normalization_method
+                    options["normalization_method"] = normalization_method
                 
                 with tabs[3]:
                     # Summary tab content
@@ -274,8 +306,13 @@ else:
 
         _, c1, _ = st.columns(3)
         if c1.button("**Submit Data for Statistics!**", type="primary"):
-            st.session_state["md"], st.session_state["data"] = normalization(
-                ft, md, normalization_method
-            )
-            st.session_state["data_preparation_done"] = True
-            st.rerun()
\ No newline at end of file
+            try:
+                # the steps above are cached, they are not computed again
+                st.session_state["md"], st.session_state["data"] = prepare_data(loaded_ft, loaded_md, **options)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                # shared by all tests, built once per submission
+                get_dataset()
+                st.session_state["data_preparation_done"] = True
+                st.rerun()
\ No newline at end of file
@@ -1,6 +1,7 @@
 import streamlit as st
 from src.common import *
 from src.pca import *
+from src.dataset import *
 
 page_setup()
 
@@ -24,14 +25,20 @@ if not st.session_state.data.empty:
     c2.selectbox(
         "attribute for PCA plot", st.session_state.md.columns, key="pca_attribute"
     )
+    c1.checkbox(
+        "32-bit precision",
+        False,
+        key="pca_float32",
+        help="Compute PCA with 32-bit floats, faster and less memory for very large tables.",
+    )
     pca_variance, pca_df = get_pca_df(
-        st.session_state.data, st.session_state.n_components
+        get_dataset(), st.session_state.n_components, st.session_state.pca_float32
     )
 
     t1, t2, t3 = st.tabs(["📈 PCA Plot", "📊 Explained variance", "📁 Data"])
     with t1:
         fig = get_pca_scatter_plot(
-            pca_df, pca_variance, st.session_state.pca_attribute, st.session_state.md
+            get_dataset(), pca_df, pca_variance, st.session_state.pca_attribute
         )
         show_fig(fig, "principal-component-analysis")
     with t2:
@@ -3,6 +3,7 @@ from src.common import *
 
 try:
     from src.pcoa import *
+    from src.dataset import *
 
     page_setup()
 
@@ -48,10 +49,29 @@ try:
             ],
             key="pcoa_distance_matrix",
         )
+        c1.number_input(
+            "number of permutations",
+            99,
+            99999,
+            999,
+            100,
+            key="permanova_permutations",
+            help="Number of permutations for the PERMANOVA p-value, the smallest possible p-value is 1/(permutations + 1).",
+        )
+        c2.number_input("random seed", 0, None, 123, key="permanova_seed", help="Fixed seed to make the permutations reproducible.")
+        st.checkbox(
+            "stop permutations early when the p-value is clearly above or below 0.05",
+            False,
+            key="permanova_early_stopping",
+            help="Saves time on large datasets, the p-value is then based on fewer permutations.",
+        )
         permanova, pcoa_result = permanova_pcoa(
-            st.session_state.data,
+            get_dataset(),
             st.session_state.pcoa_distance_matrix,
-            st.session_state.md[st.session_state.pcoa_attribute],
+            st.session_state.pcoa_attribute,
+            st.session_state.permanova_permutations,
+            st.session_state.permanova_seed,
+            st.session_state.permanova_early_stopping,
         )
 
         if not permanova.empty:
@@ -1,6 +1,7 @@
 import streamlit as st
 from src.common import *
 from src.clustering import *
+from src.dataset import *
 
 page_setup()
 
@@ -11,25 +12,75 @@ with st.expander("📖 About"):
         """
 Hierarchical clustering analysis (HCA) is a popular unsupervised technique used for grouping data points based on their similarities. In this method, the data is organized in a tree-like structure or dendrogram, where each branch represents a cluster of data points with similar features. The clustering process starts with each data point being considered as a separate cluster, and then iteratively combines similar clusters until all the data points are in a single cluster.
 
-The clustering relies on a distance matrix 'distm', calculated from the feature quantification table (submitted during the data preparation stage), using a specific distance metric  (e.g., Euclidean, Canberra). By default, we use Euclidean distance. Another important factor is the linkage method, which measures the distance between these clusters (e.g., complete, single, average). Our default choice uses the 'complete' method, it calculates the maximum distance between clusters before merging them. Currently, users do not have the option to adjust the distance metric or linkage method. Following HCA, a dendrogram is produced, showing the distances (or 'heights') at which clusters merge or split along the y-axis. The dendrogram offers insights into the clustering process and the relationships between data points. There are a lot of [good videos](https://www.youtube.com/watch?v=7xHsRkOdVwo) and resources out there explaining very well the principle behind clustering. 
+The clustering relies on a distance matrix 'distm', calculated from the feature quantification table (submitted during the data preparation stage), using a specific distance metric  (e.g., Euclidean, Canberra). By default, we use Euclidean distance. Another important factor is the linkage method, which measures the distance between these clusters (e.g., complete, single, average). Our default choice uses the 'complete' method, it calculates the maximum distance between clusters before merging them. Both the distance metric and the linkage method can be selected below (ward, centroid and median linkage require Euclidean distances). Following HCA, a dendrogram is produced, showing the distances (or 'heights') at which clusters merge or split along the y-axis. The dendrogram offers insights into the clustering process and the relationships between data points. There are a lot of [good videos](https://www.youtube.com/watch?v=7xHsRkOdVwo) and resources out there explaining very well the principle behind clustering. 
 
 Complementing the dendrogram, heatmaps provide a color-coded representation of data, showcasing trends of each feature across samples. Heatmaps are particularly useful for analyzing large datasets with complex relationships between features. The heatmap provides an easy-to-read visualization of the similarities and differences between the data points (features) and clusters, with similar data points appearing as blocks of similar colors, suggesting functional relationships between features and sample. 
 
-The dataset used for both HCA and heatmap is the data submitted for statistics from the ‘Data preparation stage’. Similarly, the downloadable table in this section corresponds to the same dataset submitted for statistical analysis. While current settings for HCA parameters are fixed to defaults, these tools (HCA and heatmaps) still offer valuable insights into the dataset's inherent clustering and variable relationships.
+The dataset used for both HCA and heatmap is the data submitted for statistics from the ‘Data preparation stage’. Similarly, the downloadable table in this section corresponds to the same dataset submitted for statistical analysis. For large datasets only the most variable features are clustered and shown in the heatmap, since the memory needed for clustering grows with the square of the number of features.
 """
     )
     st.image("assets/figures/clustering.png")
 
 if not st.session_state.data.empty:
-    t1, t2, t3 = st.tabs(["📈 Clustering", "📊 Heatmap", "📁 Heatmap Data"])
-    with t1:
-        fig = get_dendrogram(st.session_state.data, "bottom")
-        show_fig(fig, "clustering")
-    fig, df = get_heatmap(st.session_state.data)
-    with t2:
-
-        show_fig(fig, "heatmap")
-    with t3:
-        show_table(df, "heatmap-data")
+    n_features = st.session_state.data.shape[1]
+    c1, c2, c3 = st.columns(3)
+    c1.selectbox("linkage method", methods, key="clustering_method")
+    c2.selectbox(
+        "distance metric",
+        ["euclidean"] if st.session_state.clustering_method in euclidean_methods else metrics,
+        key="clustering_metric",
+    )
+    c3.number_input(
+        "maximum number of features in heatmap",
+        min(100, n_features),
+        n_features,
+        min(5000, n_features),
+        100,
+        key="clustering_max_features",
+        help="Only the most variable features are clustered and shown in the heatmap, memory and time needed grow with the square of the number of features.",
+    )
+    try:
+        t1, t2, t3 = st.tabs(["📈 Clustering", "📊 Heatmap", "📁 Heatmap Data"])
+        with t1:
+            fig = get_dendrogram(
+                get_dataset(), "bottom", st.session_state.clustering_metric, st.session_state.clustering_method
+            )
+            show_fig(fig, "clustering")
+        clustering_args = (
+            get_dataset(),
+            st.session_state.clustering_metric,
+            st.session_state.clustering_method,
+            st.session_state.clustering_max_features,
+        )
+        # clustered table only, the figure is built for the selected view
+        df, _ = get_clustered_data(*clustering_args)
+        with t2:
+            c1, c2 = st.columns(2)
+            c1.radio(
+                "heatmap view",
+                ["all features", "mean per dendrogram branch"],
+                index=int(df.shape[0] > 1000),
+                key="heatmap_view",
+                help="For many features the overview shows the mean intensities of the feature dendrogram branches, select a branch to see its features.",
+            )
+            if st.session_state.heatmap_view == "all features":
+                fig, _ = get_heatmap(*clustering_args)
+                show_fig(fig, "heatmap")
+            else:
+                c2.number_input("number of branches", 2, max(2, min(200, df.shape[0])), min(50, df.shape[0]), key="heatmap_branches")
+                fig, branches = get_branch_heatmap(*clustering_args, st.session_state.heatmap_branches)
+                show_fig(fig, "heatmap-branches")
+                branch = st.selectbox(
+                    "show features of branch",
+                    [None] + sorted(branches.unique()),
+                    format_func=lambda b: "-" if b is None else f"branch {b} (n={(branches == b).sum()})",
+                )
+                if branch:
+                    fig, _ = get_branch_detail_heatmap(*clustering_args, st.session_state.heatmap_branches, branch)
+                    show_fig(fig, f"heatmap-branch-{branch}")
+        with t3:
+            show_table(df, "heatmap-data")
+    except ValueError as e:
+        st.error(f"Clustering failed with the selected distance metric: {e}")
 else:
     st.warning("Please complete data preparation step first!")
\ No newline at end of file
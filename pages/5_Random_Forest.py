@@ -1,6 +1,8 @@
 import streamlit as st
+import os
 from src.common import *
 from src.randomforest import *
+from src.dataset import *
 
 page_setup()
 
@@ -25,20 +27,50 @@ if not st.session_state.data.empty:
                     key = "rf_n_trees",
                     help="number of trees for random forest, check the OOB error plot and select a number of trees where the error rate is low and flat")
     
+    c1.number_input("number of CPU cores", 1, os.cpu_count(), min(4, os.cpu_count()), key="rf_n_jobs",
+                    help="number of CPU cores used to build the trees of the random forest and the OOB error curve")
+
     random_seed = 123 if use_random_seed else None
 
+    c2.radio("validation", ["train/test split", "stratified k-fold cross-validation"], key="rf_validation",
+             help="cross-validation fits one forest per fold and reports mean ± sd over the folds, which is less noisy for small sample sizes")
+    if st.session_state.rf_validation == "stratified k-fold cross-validation":
+        c2.number_input("number of folds", 2, 20, 5, key="rf_n_folds",
+                        help="limited to the size of the smallest class")
+    else:
+        c1.checkbox("permutation importance", False, key="rf_permutation",
+                    help="decrease in test set accuracy when a feature is permuted, less biased toward high-variance features than the impurity based importance")
+        if st.session_state.rf_permutation:
+            c1.number_input("top features for permutation importance", 1, 1000, 50, key="rf_top_k",
+                            help="only the features with the highest impurity based importance are permuted")
+            c1.number_input("permutation repeats", 2, 100, 10, key="rf_n_repeats")
+
     if c2.button("Run supervised learning", type="primary"):
+        if random_seed is None:
+            # a new seed for every run, the results are cached in memory for this seed (not stored on disk) and it is shown in the log
+            random_seed = int(np.random.SeedSequence().entropy % 2**32)
         try:
-            df_oob, df_important_features, log, class_report, label_mapping, test_confusion_df, train_confusion_df, test_accuracy, train_accuracy = run_random_forest(st.session_state.rf_attribute, st.session_state.rf_n_trees, random_seed)
-            st.session_state['df_oob'] = df_oob
+            if st.session_state.rf_validation == "stratified k-fold cross-validation":
+                df_important_features, log, class_report, label_mapping, confusion_df, confusion_sd_df, accuracy, accuracy_sd = run_random_forest_cv(get_dataset(), st.session_state.rf_attribute, st.session_state.rf_n_trees, random_seed, st.session_state.rf_n_folds, st.session_state.rf_n_jobs, _store=use_random_seed)
+                st.session_state['rf_cv'] = True
+                st.session_state['df_oob'] = None
+                st.session_state['test_confusion_df'] = confusion_df
+                st.session_state['test_confusion_sd_df'] = confusion_sd_df
+                st.session_state['test_accuracy'] = accuracy
+                st.session_state['test_accuracy_sd'] = accuracy_sd
+            else:
+                top_k = st.session_state.rf_top_k if st.session_state.rf_permutation else 0
+                df_oob, df_important_features, log, class_report, label_mapping, test_confusion_df, train_confusion_df, test_accuracy, train_accuracy = run_random_forest(get_dataset(), st.session_state.rf_attribute, st.session_state.rf_n_trees, random_seed, st.session_state.rf_n_jobs, top_k, st.session_state.get("rf_n_repeats", 10), _store=use_random_seed)
+                st.session_state['rf_cv'] = False
+                st.session_state['df_oob'] = df_oob
+                st.session_state['test_confusion_df'] = test_confusion_df
+                st.session_state['train_confusion_df'] = train_confusion_df
+                st.session_state['test_accuracy'] = test_accuracy
+                st.session_state['train_accuracy'] = train_accuracy
             st.session_state['df_important_features'] = df_important_features
-            st.session_state['log'] = log
+            st.session_state['log'] = f"Random seed: {random_seed}\n" + log
             st.session_state['class_report'] = class_report
             st.session_state['label_mapping'] = label_mapping
-            st.session_state['test_confusion_df'] = test_confusion_df
-            st.session_state['train_confusion_df'] = train_confusion_df
-            st.session_state['test_accuracy'] = test_accuracy
-            st.session_state['train_accuracy'] = train_accuracy
         except Exception as e:
             st.error(f"Failed to run model due to: {str(e)}")
 
@@ -48,8 +80,11 @@ if 'df_important_features' in st.session_state and not st.session_state.df_impor
                     "📋 Classification Report",
                     "🔍 Confusion Matrix"])
     with tabs[0]:
-        fig = get_oob_fig(st.session_state.df_oob)
-        show_fig(fig, "oob-error")
+        if st.session_state.get("rf_cv"):
+            st.info("The OOB error curve is available with the train/test split validation.")
+        else:
+            fig = get_oob_fig(st.session_state.df_oob)
+            show_fig(fig, "oob-error")
     with tabs[1]:
         show_table(st.session_state.df_important_features)
     with tabs[2]:  # Classification Report
@@ -74,10 +109,17 @@ if 'df_important_features' in st.session_state and not st.session_state.df_impor
             merged_df.set_index('Label', inplace=True)
             st.dataframe(merged_df)
     with tabs[3]:
-        st.subheader("Test Set Confusion Matrix")
-        st.dataframe(st.session_state.test_confusion_df)
-        st.write(f"Test Set Accuracy: {st.session_state.test_accuracy:.2%}")
+        if st.session_state.get("rf_cv"):
+            st.subheader("Confusion Matrix (mean over test folds)")
+            st.dataframe(st.session_state.test_confusion_df)
+            st.subheader("Confusion Matrix (sd over test folds)")
+            st.dataframe(st.session_state.test_confusion_sd_df)
+            st.write(f"Cross-Validation Accuracy: {st.session_state.test_accuracy:.2%} ± {st.session_state.test_accuracy_sd:.2%}")
+        else:
+            st.subheader("Test Set Confusion Matrix")
+            st.dataframe(st.session_state.test_confusion_df)
+            st.write(f"Test Set Accuracy: {st.session_state.test_accuracy:.2%}")
 
-        st.subheader("Train Set Confusion Matrix")
-        st.dataframe(st.session_state.train_confusion_df)
-        st.write(f"Train Set Accuracy: {st.session_state.train_accuracy:.2%}")
\ No newline at end of file
+            st.subheader("Train Set Confusion Matrix")
+            st.dataframe(st.session_state.train_confusion_df)
+            st.write(f"Train Set Accuracy: {st.session_state.train_accuracy:.2%}")
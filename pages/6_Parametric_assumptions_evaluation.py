@@ -2,6 +2,7 @@ import streamlit as st
 
 from src.common import *
 from src.testparametric import *
+from src.dataset import *
 
 page_setup()
 
@@ -35,12 +36,18 @@ if not st.session_state.data.empty:
     if st.session_state.test_attribute and len(st.session_state.test_options) == 2:
         tabs = st.tabs(["📊 Normal distribution (Shapiro-Wilk test)", "📊 Equal variance (Levene test)"])
         with tabs[0]:
-            fig = test_normal_distribution(st.session_state.test_attribute, st.session_state.test_options, corrections_map[st.session_state.p_value_correction])
+            normality, fig = test_normal_distribution(get_dataset(), st.session_state.test_attribute, st.session_state.test_options, corrections_map[st.session_state.p_value_correction])
             if fig:
                 show_fig(fig, "test-normal-distribution")
+                with st.expander("📁 p-values per feature"):
+                    show_table(normality, "test-normal-distribution")
+            else:
+                st.warning("You need at least 3 values in each option to test for normality!")
         with tabs[1]:
-            fig = test_equal_variance(st.session_state.test_attribute, st.session_state.test_options, corrections_map[st.session_state.p_value_correction])
+            variance, fig = test_equal_variance(get_dataset(), st.session_state.test_attribute, st.session_state.test_options, corrections_map[st.session_state.p_value_correction])
             show_fig(fig, "test-equal-variance")
+            with st.expander("📁 p-values per feature"):
+                show_table(variance, "test-equal-variance")
 
     st.info(
         """💡 **Interpretation**
@@ -1,6 +1,7 @@
 import streamlit as st
 from src.common import *
 from src.anova import *
+from src.dataset import *
 
 
 page_setup()
@@ -25,7 +26,7 @@ if not st.session_state.data.empty:
     c1.button("Run ANOVA", key="run_anova", type="primary")
     if st.session_state.run_anova:
         st.session_state.df_anova = anova(
-            st.session_state.data,
+            get_dataset(),
             st.session_state.anova_attribute,
             corrections_map[st.session_state.p_value_correction]
         )
@@ -53,6 +54,7 @@ if not st.session_state.data.empty:
         )
         if st.session_state.run_tukey:
             st.session_state.df_tukey = tukey(
+                get_dataset(),
                 st.session_state.df_anova,
                 st.session_state.anova_attribute,
                 st.session_state.tukey_elements,
@@ -71,7 +73,7 @@ if not st.session_state.data.empty:
     if not st.session_state.df_anova.empty:
         tabs = st.tabs(tab_options)
         with tabs[0]:
-            fig = get_anova_plot(st.session_state.df_anova)
+            fig = get_anova_plot(st.session_state.df_anova, st.session_state.anova_attribute)
             show_fig(fig, "anova")
         with tabs[1]:
             show_table(st.session_state.df_anova)
@@ -90,7 +92,9 @@ if not st.session_state.data.empty:
             )
 
             fig = get_metabolite_boxplot(
+                get_dataset(),
                 st.session_state.df_anova,
+                st.session_state.anova_attribute,
                 st.session_state.anova_metabolite,
             )
 
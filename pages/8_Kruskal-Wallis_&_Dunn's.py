@@ -1,6 +1,7 @@
 import streamlit as st
 from src.common import *
 from src.kruskal import *
+from src.dataset import *
 
 
 page_setup()
@@ -25,7 +26,7 @@ if not st.session_state.data.empty:
     c1.button("Run Kruskal Wallis", key="run_kruskal", type="primary")
     if st.session_state.run_kruskal:
         st.session_state.df_kruskal = kruskal_wallis(
-            st.session_state.data, st.session_state.kruskal_attribute,
+            get_dataset(), st.session_state.kruskal_attribute,
             corrections_map[st.session_state.p_value_correction]
         )
         st.rerun()
@@ -53,6 +54,7 @@ if not st.session_state.data.empty:
             )
             if st.session_state.run_dunn:
                 st.session_state.df_dunn = dunn(
+                    get_dataset(),
                     st.session_state.df_kruskal,
                     st.session_state.kruskal_attribute,
                     st.session_state.dunn_elements,
@@ -73,7 +75,7 @@ if not st.session_state.data.empty:
     if not st.session_state.df_kruskal.empty:
         tabs = st.tabs(tab_options)
         with tabs[0]:
-            fig = get_kruskal_plot(st.session_state.df_kruskal)
+            fig = get_kruskal_plot(st.session_state.df_kruskal, st.session_state.kruskal_attribute)
             show_fig(fig, "kruskal")
         with tabs[1]:
             show_table(st.session_state.df_kruskal)
@@ -92,7 +94,9 @@ if not st.session_state.data.empty:
             )
             if st.session_state.kruskal_metabolite:
                 fig = get_metabolite_boxplot(
+                    get_dataset(),
                     st.session_state.df_kruskal,
+                    st.session_state.kruskal_attribute,
                     st.session_state.kruskal_metabolite,
                 )
                 show_fig(fig, f"kruskal-{st.session_state.kruskal_metabolite}")
@@ -2,6 +2,7 @@ import streamlit as st
 
 from src.common import *
 from src.ttest import *
+from src.dataset import *
 
 page_setup()
 
@@ -45,15 +46,19 @@ if not st.session_state.data.empty:
 
 
     if c2.button("Run t-test", type="primary", disabled=(len(st.session_state.ttest_options) != 2)):
-        st.session_state.df_ttest = gen_ttest_data(
-            st.session_state.ttest_attribute,
-            st.session_state.ttest_options,
-            st.session_state.ttest_paired,
-            st.session_state.ttest_alternative,
-            st.session_state.ttest_correction,
-            corrections_map[st.session_state.p_value_correction]
-        )
-        st.rerun()
+        try:
+            st.session_state.df_ttest = gen_ttest_data(
+                get_dataset(),
+                st.session_state.ttest_attribute,
+                st.session_state.ttest_options,
+                st.session_state.ttest_paired,
+                st.session_state.ttest_alternative,
+                st.session_state.ttest_correction,
+                corrections_map[st.session_state.p_value_correction]
+            )
+            st.rerun()
+        except ValueError as e:
+            st.error(str(e))
 
     if not st.session_state.df_ttest.empty:
         tabs = st.tabs(
@@ -67,7 +72,7 @@ if not st.session_state.data.empty:
             cols[0].selectbox(
                 "metabolite", st.session_state.df_ttest.index, key="ttest_metabolite"
             )
-            fig = ttest_boxplot(st.session_state.df_ttest,
+            fig = ttest_boxplot(get_dataset(), st.session_state.df_ttest,
                 st.session_state.ttest_metabolite
             )
             show_fig(fig, f"ttest-boxplot-{st.session_state.ttest_metabolite}", False)
@@ -1,19 +1,43 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import pingouin as pg
 import plotly.express as px
 import plotly.graph_objects as go
+import scipy.stats as stats
+from scipy.interpolate import CubicSpline
+from .groupstats import group_sums
+from .dataset import cache_data, cache_resource, store_results
+from .profiling import profile
 
 
-def gen_anova_data(df, columns, groups_col):
-    for col in columns:
-        result = pg.anova(data=df, dv=col, between=groups_col, detailed=True).set_index(
-            "Source"
-        )
-        p = result.loc[groups_col, "p-unc"]
-        f = result.loc[groups_col, "F"]
-        yield col, p, f
+def get_anova_data(X, codes, groups, columns):
+    """One-way ANOVA for all feature columns at once.
+
+    Sums of squares are computed from per-group sums of the whole intensity matrix,
+    instead of calling pg.anova once per metabolite.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, k = X.shape[0], len(groups)
+
+    n_group = np.bincount(codes, minlength=k).astype(np.float64)
+    means = group_sums(X, codes, k) / n_group[:, None]
+    grand_mean = X.mean(axis=0)
+
+    ss_between = (n_group[:, None] * (means - grand_mean) ** 2).sum(axis=0)
+    ss_within = ((X - means[codes]) ** 2).sum(axis=0)
+    df_between, df_within = k - 1, n - k
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        f = (ss_between / df_between) / (ss_within / df_within)
+    p = stats.f.sf(f, df_between, df_within)
+
+    return pd.DataFrame(
+        {
+            "metabolite": np.asarray(columns).astype(str),
+            "p": p.astype(np.float32),
+            "F": f.astype(np.float32),
+        }
+    )
 
 
 def add_p_correction_to_anova(df, correction):
@@ -29,25 +53,19 @@ def add_p_correction_to_anova(df, correction):
     return df
 
 
-@st.cache_data
-def anova(df, attribute, correction):
-    df = pd.DataFrame(
-        np.fromiter(
-            gen_anova_data(
-                pd.concat([df, st.session_state.md], axis=1),
-                df.columns,
-                attribute,
-            ),
-            dtype=[("metabolite", "U100"), ("p", "f"), ("F", "f")],
-        )
-    )
+@profile
+@cache_data
+@store_results
+def anova(dataset, attribute, correction):
+    df = get_anova_data(*dataset.select(attribute), dataset.features)
     df = df.dropna()
     df = add_p_correction_to_anova(df, correction)
     return df.set_index("metabolite")
 
 
-@st.cache_resource
-def get_anova_plot(anova):
+@profile
+@cache_resource
+def get_anova_plot(anova, attribute):
     # first plot insignificant features
     fig = px.scatter(
         x=anova[anova["significant"] == False]["F"].apply(np.log),
@@ -73,7 +91,7 @@ def get_anova_plot(anova):
     fig.update_layout(
         font={"color": "grey", "size": 12, "family": "Sans"},
         title={
-            "text": f"ANOVA - {st.session_state.anova_attribute.upper()}",
+            "text": f"ANOVA - {attribute.upper()}",
             "font_color": "#3E3D53"
         },
         xaxis_title="log(F)",
@@ -88,13 +106,11 @@ def get_anova_plot(anova):
     return fig
 
 
-@st.cache_resource
-def get_metabolite_boxplot(anova, metabolite):
-    attribute = st.session_state.anova_attribute
+@profile
+@cache_resource
+def get_metabolite_boxplot(dataset, anova, attribute, metabolite):
     p_value = anova.loc[metabolite, "p-corrected"]
-    df = pd.concat([st.session_state.data, st.session_state.md], axis=1)[
-        [attribute, metabolite]
-    ]
+    df = dataset.get_feature(attribute, metabolite)
     title = f"{metabolite}<br>corrected p-value: {str(p_value)[:6]}"
     fig = px.box(
         df,
@@ -116,20 +132,72 @@ def get_metabolite_boxplot(anova, metabolite):
     return fig
 
 
-def gen_pairwise_tukey(df, metabolites, attribute):
-    """Yield results for pairwise Tukey test for all metabolites between two options within the attribute."""
-    for metabolite in metabolites:
-        tukey = pg.pairwise_tukey(df, dv=metabolite, between=attribute)
-        yield (
-            metabolite,
-            tukey.loc[0, "diff"],
-            tukey.loc[0, "p-tukey"],
-            attribute,
-            tukey.loc[0, "A"],
-            tukey.loc[0, "B"],
-            tukey.loc[0, "mean(A)"],
-            tukey.loc[0, "mean(B)"],
-        )
+def studentized_range_sf(q, k, df):
+    """studentized_range.sf for an array of q values at fixed k and df.
+
+    scipy integrates numerically for every single value, so the survival function is
+    evaluated once on a grid and log(sf) is interpolated with a cubic spline.
+    scipy is accurate to about 1e-14, the grid ends where sf drops below 1e-12 and
+    values beyond it are set to zero. Without degrees of freedom (or groups) p is NaN.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    if df < 1 or k < 2:
+        return np.full(q.shape, np.nan)
+    q_max = 8.0
+    while stats.studentized_range.sf(q_max, k, df) > 1e-12 and q_max < 1e6:
+        q_max *= 2
+    grid = np.unique(np.concatenate([np.linspace(0, 8, 96), np.geomspace(8, q_max, 64)]))
+    sf = stats.studentized_range.sf(grid, k, df)
+    grid, sf = grid[sf > 1e-12], sf[sf > 1e-12]
+    log_sf = CubicSpline(grid, np.log(sf))
+
+    p = np.where(np.isnan(q), np.nan, 0.0)
+    inside = q <= grid[-1]
+    p[inside] = np.exp(log_sf(q[inside]))
+    return np.clip(p, 0, 1)
+
+
+def get_tukey_data(X, codes, groups, columns):
+    """Tukey HSD for all feature columns and all pairs of groups at once.
+
+    The mean squared error comes from all groups, as in pg.pairwise_tukey.
+    Returns one row per metabolite and pair.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, k = X.shape[0], len(groups)
+
+    n_group = np.bincount(codes, minlength=k).astype(np.float64)
+    means = group_sums(X, codes, k) / n_group[:, None]
+    ss_group = group_sums((X - means[codes]) ** 2, codes, k)
+    df = n - k
+    mse = ss_group.sum(axis=0) / df
+
+    # (pairs x features) statistics
+    a, b = np.triu_indices(k, 1)
+    diff = means[a] - means[b]
+    se = np.sqrt(mse * (1 / n_group[a] + 1 / n_group[b])[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = diff / se
+        # Hedges g from the pooled standard deviation of the two groups
+        pooled_sd = np.sqrt((ss_group[a] + ss_group[b]) / (n_group[a] + n_group[b] - 2)[:, None])
+        hedges = diff / pooled_sd * (1 - 3 / (4 * (n_group[a] + n_group[b]) - 9))[:, None]
+    p = studentized_range_sf(np.sqrt(2) * np.abs(t), k, df)
+
+    n_features = X.shape[1]
+    return pd.DataFrame(
+        {
+            "stats_metabolite": np.tile(np.asarray(columns).astype(str), len(a)),
+            "diff": diff.ravel().astype(np.float32),
+            "stats_p": p.ravel().astype(np.float32),
+            "A": np.repeat(groups[a], n_features),
+            "B": np.repeat(groups[b], n_features),
+            "mean(A)": means[a].ravel().astype(np.float32),
+            "mean(B)": means[b].ravel().astype(np.float32),
+            "se": se.ravel().astype(np.float32),
+            "T": t.ravel().astype(np.float32),
+            "hedges": hedges.ravel().astype(np.float32),
+        }
+    )
 
 
 def add_p_value_correction_to_tukeys(tukey, correction):
@@ -146,39 +214,40 @@ def add_p_value_correction_to_tukeys(tukey, correction):
     return tukey
 
 
-@st.cache_data
-def tukey(df, attribute, elements, correction):
+@profile
+@cache_data
+def tukey_all_pairs(dataset, df, attribute):
     significant_metabolites = df[df["significant"]].index
-    data = pd.concat(
-        [
-            st.session_state.data.loc[:, significant_metabolites],
-            st.session_state.md.loc[:, attribute],
-        ],
-        axis=1,
-    )
-    data = data[data[attribute].isin(elements)]
-    tukey = pd.DataFrame(
-        np.fromiter(
-            gen_pairwise_tukey(data, significant_metabolites, attribute),
-            dtype=[
-                ("stats_metabolite", "U100"),
-                (f"diff", "f"),
-                ("stats_p", "f"),
-                ("attribute", "U100"),
-                ("A", "U100"),
-                ("B", "U100"),
-                ("mean(A)", "f"),
-                ("mean(B)", "f"),
-            ],
-        )
+    return get_tukey_data(
+        *dataset.select(attribute, columns=dataset.get_columns(significant_metabolites)), significant_metabolites
     )
-    tukey = tukey.dropna()
+
+
+@profile
+@cache_data
+@store_results
+def tukey(dataset, df, attribute, elements, correction):
+    # all pairs are computed once per attribute, selecting another pair only slices the table
+    tukey = tukey_all_pairs(dataset, df, attribute)
+    a, b = elements
+    flipped = (tukey["A"] == b) & (tukey["B"] == a)
+    tukey = tukey[((tukey["A"] == a) & (tukey["B"] == b)) | flipped].copy()
+    if flipped.any():
+        tukey[["A", "B"]] = a, b
+        tukey[["mean(A)", "mean(B)"]] = tukey[["mean(B)", "mean(A)"]].values
+        tukey[["diff", "T", "hedges"]] *= -1
+    tukey.insert(3, "attribute", attribute)
+    tukey = tukey.dropna().reset_index(drop=True)
     tukey = add_p_value_correction_to_tukeys(tukey, correction)
     return tukey
 
 
-@st.cache_resource
+@profile
+@cache_resource
 def get_tukey_volcano_plot(df):
+    # attribute and the two groups are taken from the result table
+    attribute, a, b = df[["attribute", "A", "B"]].iloc[0]
+
     # create figure
     fig = px.scatter(template="plotly_white")
 
@@ -213,7 +282,7 @@ def get_tukey_volcano_plot(df):
     fig.update_layout(
         font={"color": "grey", "size": 12, "family": "Sans"},
         title={
-            "text": f"TUKEY - {st.session_state.anova_attribute.upper()}: {st.session_state.tukey_elements[0]} - {st.session_state.tukey_elements[1]}",
+            "text": f"TUKEY - {attribute.upper()}: {a} - {b}",
             "font_color": "#3E3D53",
         },
         xaxis_title=f"diff",
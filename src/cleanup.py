@@ -3,10 +3,52 @@ import pandas as pd
 import numpy as np
 import plotly.express as px
 from sklearn.preprocessing import StandardScaler
+from .profiling import profile
+from .dataset import cache_data, cache_resource
 # currently conflicting dependencies (requires old pandas 1.2.4)
 # from pynmranalysis.normalization import PQN_normalization
 
-@st.cache_data
+# feature tables with at least this fraction of zeros are kept sparse until imputation/normalization
+SPARSE_MIN_ZEROS = 0.5
+
+
+def is_sparse(df):
+    return not df.empty and all(isinstance(dtype, pd.SparseDtype) for dtype in df.dtypes)
+
+
+def to_sparse(df):
+    # only the non-zero intensities are stored
+    return df.astype({col: pd.SparseDtype(dtype, 0) for col, dtype in df.dtypes.items()})
+
+
+def to_dense(df):
+    return df.sparse.to_dense() if is_sparse(df) else df
+
+
+def get_nonzero_entries(df):
+    """Row positions and values of all non-zero entries (NaN included) of the feature table."""
+    if is_sparse(df):
+        coo = df.sparse.to_coo()
+        rows, values = coo.row, coo.data
+    else:
+        rows, cols = np.nonzero(df.to_numpy() != 0)
+        values = df.to_numpy()[rows, cols]
+    nonzero = values != 0
+    return rows[nonzero], values[nonzero]
+
+
+def get_row_means(df):
+    # NaN values are not skipped
+    rows, values = get_nonzero_entries(df)
+    return pd.Series(np.bincount(rows, weights=values, minlength=len(df)) / df.shape[1], index=df.index)
+
+
+def get_missing_fraction(df):
+    # fraction of zeros in the feature table
+    return 1 - len(get_nonzero_entries(df)[1]) / df.size
+
+@profile
+@cache_data
 def clean_up_md(md):
     md = (
         md.copy()
@@ -25,7 +67,8 @@ def clean_up_md(md):
     return md
 
 
-@st.cache_data
+@profile
+@cache_data
 def clean_up_ft(ft):
     ft = (
         ft.copy()
@@ -38,10 +81,14 @@ def clean_up_ft(ft):
         columns={col: col.replace(" Peak area", "").replace(".mzXML", "").replace(".mzML", "").strip() for col in ft.columns},
         inplace=True,
     )
+    numeric = all(pd.api.types.is_numeric_dtype(dtype) for dtype in ft.dtypes)
+    if numeric and ft.size and (ft == 0).to_numpy().mean() >= SPARSE_MIN_ZEROS:
+        ft = to_sparse(ft)
     return ft
 
 
-@st.cache_data
+@profile
+@cache_data
 def check_columns(md, ft):
     if sorted(ft.columns) != sorted(md.index):
         st.warning("Not all files are present in both meta data & feature table.")
@@ -61,7 +108,8 @@ def check_columns(md, ft):
     return md, ft
 
 
-@st.cache_data
+@profile
+@cache_data
 def inside_levels(df):
     df = pd.DataFrame(
         {
@@ -73,19 +121,19 @@ def inside_levels(df):
     return df
 
 
-@st.cache_data
+@profile
+@cache_data
 def get_cutoff_LOD(df):
     # get the minimal value that is not zero (lowest measured intensity)
-    return round(df.replace(0, np.nan).min(numeric_only=True).min())
+    return round(np.nanmin(get_nonzero_entries(df)[1]))
 
 
-@st.cache_data
+@profile
+@cache_data
 def remove_blank_features(blanks, samples, cutoff):
-    # Getting mean for every feature in blank and Samples
-    avg_blank = blanks.mean(
-        axis=1, skipna=False
-    )  # set skipna = False do not exclude NA/null values when computing the result.
-    avg_samples = samples.mean(axis=1, skipna=False)
+    # Getting mean for every feature in blank and Samples (from the non-zero entries)
+    avg_blank = get_row_means(blanks)
+    avg_samples = get_row_means(samples)
 
     # Getting the ratio of blank vs samples
     ratio_blank_samples = (avg_blank + 1) / (avg_samples + 1)
@@ -102,16 +150,74 @@ def remove_blank_features(blanks, samples, cutoff):
     return blank_removal, n_background, n_real_features
 
 
-@st.cache_data
-def impute_missing_values(df, cutoff_LOD):
-    # impute missing values (0) with a random value between one and lowest intensity (cutoff_LOD)
-    if cutoff_LOD > 1:
-        return df.apply(
-            lambda x: [np.random.randint(1, cutoff_LOD) if v == 0 else v for v in x]
-        )
-
-
-@st.cache_resource
+imputation_methods = {
+    "random value between 1 and LOD": "random",
+    "half-minimum per feature": "half-minimum",
+    "LOD (constant)": "LOD",
+    "k-nearest neighbour samples": "KNN",
+}
+
+
+def get_knn_distances(X, missing, chunk_size=5000):
+    """Euclidean distances between samples (columns of X) over the features observed in both.
+
+    Features are processed in chunks so only a (chunk x samples) block is converted to
+    float64 at a time; distances are scaled up by the fraction of shared features.
+    """
+    n_samples = X.shape[1]
+    squared = np.zeros((n_samples, n_samples))
+    shared = np.zeros((n_samples, n_samples))
+    for start in range(0, X.shape[0], chunk_size):
+        observed = ~missing[start : start + chunk_size]
+        values = np.where(observed, X[start : start + chunk_size], 0).astype(np.float64)
+        observed = observed.astype(np.float64)
+        squared += (values**2).T @ observed + observed.T @ values**2 - 2 * values.T @ values
+        shared += observed.T @ observed
+    with np.errstate(divide="ignore", invalid="ignore"):
+        distances = np.sqrt(np.clip(squared, 0, None) * X.shape[0] / shared)
+    distances[shared == 0] = np.inf
+    np.fill_diagonal(distances, np.inf)
+    return distances
+
+
+@profile
+@cache_data
+def impute_missing_values(df, cutoff_LOD, method="random", seed=None, n_neighbors=5):
+    # impute missing values (0), all methods fill a float32 copy of the feature table in place
+    df = to_dense(df)
+    X = df.to_numpy(dtype=np.float32, copy=True)
+    missing = X == 0
+    if method == "random":
+        # random value between one and lowest intensity (cutoff_LOD)
+        if cutoff_LOD <= 1:
+            return None
+        rng = np.random.default_rng(seed)
+        X[missing] = rng.integers(1, int(cutoff_LOD), size=missing.sum())
+    elif method == "half-minimum":
+        # half of the lowest measured intensity of each feature
+        half_min = np.where(missing, np.inf, X).min(axis=1) / 2
+        X = np.where(missing & np.isfinite(half_min)[:, None], half_min[:, None], X)
+    elif method == "LOD":
+        X[missing] = cutoff_LOD
+    elif method == "KNN":
+        # mean intensity of the feature in the nearest samples in which it was measured,
+        # features without a measured value in any neighbour stay missing (0)
+        distances = get_knn_distances(X, missing)
+        for j in range(X.shape[1]):
+            neighbours = np.argsort(distances[j])[:n_neighbors]
+            neighbours = neighbours[np.isfinite(distances[j, neighbours])]
+            rows = missing[:, j]
+            # only use values that were measured, not ones imputed for earlier samples
+            observed = ~missing[np.ix_(rows, neighbours)]
+            values = np.where(observed, X[np.ix_(rows, neighbours)], 0)
+            counts = observed.sum(axis=1)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                X[rows, j] = np.where(counts > 0, values.sum(axis=1) / counts, 0)
+    return pd.DataFrame(X, index=df.index, columns=df.columns, copy=False)
+
+
+@profile
+@cache_resource
 def get_feature_frequency_fig(df):
     bins, bins_label, a = [-1, 0, 1, 10], ["-1", "0", "1", "10"], 2
 
@@ -121,11 +227,11 @@ def get_feature_frequency_fig(df):
         a += 1
 
     freq_table = pd.DataFrame(bins_label)
-    frequency = pd.DataFrame(
-        np.array(
-            np.unique(np.digitize(df.to_numpy(), bins, right=True), return_counts=True)
-        ).T
-    ).set_index(0)
+    # zeros are counted, only the non-zero intensities are binned
+    values = get_nonzero_entries(df)[1]
+    frequency = pd.Series(np.digitize(values, bins, right=True)).value_counts()
+    frequency[1] = frequency.get(1, 0) + df.size - len(values)
+    frequency = frequency.sort_index().to_frame()
     freq_table = pd.concat([freq_table, frequency], axis=1).fillna(0).drop(0)
     freq_table.columns = ["intensity", "Frequency"]
     freq_table["Log(Frequency)"] = np.log(freq_table["Frequency"] + 1)
@@ -151,10 +257,14 @@ def get_feature_frequency_fig(df):
     return fig
 
 
-@st.cache_resource
+@profile
+@cache_resource
 def get_missing_values_per_feature_fig(df, cutoff_LOD):
     # check the number of missing values per feature in a histogram
-    n_zeros = df.T.apply(lambda x: sum(x <= cutoff_LOD))
+    rows, values = get_nonzero_entries(df)
+    n_zeros = pd.Series(np.bincount(rows[values <= cutoff_LOD], minlength=len(df)), index=df.index)
+    if cutoff_LOD >= 0:
+        n_zeros += df.shape[1] - np.bincount(rows, minlength=len(df))
 
     fig = px.histogram(n_zeros, template="plotly_white", width=600, height=400)
 
@@ -170,9 +280,10 @@ def get_missing_values_per_feature_fig(df, cutoff_LOD):
     return fig
 
 
-@st.cache_data
+@profile
+@cache_data
 def normalization(feature_df, meta_data_df, normalization_method):
-    feature_df = feature_df.T
+    feature_df = to_dense(feature_df).T
 
     # remove meta data rows that are not samples
     md_rows_not_in_samples = [
@@ -208,3 +319,52 @@ def normalization(feature_df, meta_data_df, normalization_method):
     else:
         return md_samples, feature_df
     return md_samples, normalized
+
+
+def prepare_data(
+    ft,
+    md,
+    sample_attribute=None,
+    samples=None,
+    blank_attribute=None,
+    blanks=None,
+    blank_cutoff=0.3,
+    imputation=None,
+    seed=123,
+    n_neighbors=5,
+    normalization_method="None",
+):
+    """Cleanup, blank removal, imputation and normalization, as submitted by the Data Preparation page.
+
+    Used by the page and the batch pipeline. Blank removal runs if blanks is given (a list of blank groups),
+    seed is only used by the random and n_neighbors only by the KNN imputation.
+    Returns meta data and data (samples x features) as stored by "Submit Data for Statistics!".
+    """
+    md = clean_up_md(md)
+    ft = clean_up_ft(ft)
+    md, ft = check_columns(md, ft)
+
+    if blanks is not None:
+        sample_files = md[md[sample_attribute].isin(samples)].index
+        non_samples_md = md.drop(sample_files)
+        blank_files = non_samples_md[non_samples_md[blank_attribute].isin(blanks)].index
+        ft, _, _ = remove_blank_features(ft[blank_files], ft[sample_files], blank_cutoff)
+        if ft.empty:
+            raise ValueError("No features left after blank removal!")
+
+    if imputation:
+        cutoff_LOD = get_cutoff_LOD(ft)
+        imputed = impute_missing_values(
+            ft,
+            cutoff_LOD,
+            imputation,
+            seed=seed if imputation == "random" else None,
+            n_neighbors=n_neighbors if imputation == "KNN" else 5,
+        )
+        if imputed is None:
+            raise ValueError(
+                f"Can't impute with random values between 1 and lowest value, which is {cutoff_LOD} (rounded)."
+            )
+        ft = imputed
+
+    return normalization(ft, md, normalization_method)
@@ -1,62 +1,149 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from scipy.cluster.hierarchy import dendrogram, linkage
+import plotly.graph_objects as go
+from scipy.cluster.hierarchy import linkage, leaves_list, fcluster
 import plotly.figure_factory as ff
+from .distances import get_distance_matrix
+from .profiling import profile
+from .dataset import cache_data, cache_resource
 
-@st.cache_resource
-def get_dendrogram(data, label_pos="bottom"):
-    fig = ff.create_dendrogram(data, labels=list(data.index))
+metrics = ["euclidean", "cityblock", "cosine", "correlation", "braycurtis", "canberra", "chebyshev"]
+methods = ["complete", "average", "single", "weighted", "ward", "centroid", "median"]
+# these linkage methods are only defined for euclidean distances
+euclidean_methods = ["ward", "centroid", "median"]
+# larger heatmaps are rendered as image
+MAX_HEATMAP_CELLS = 100000
+
+
+def get_top_variance_features(data, max_features=None):
+    # keep the most variable features (in original order) to bound memory of the feature clustering
+    if max_features is None or data.shape[1] <= max_features:
+        return data
+    keep = np.sort(np.argsort(-data.var().to_numpy(), kind="stable")[:max_features])
+    return data.iloc[:, keep]
+
+
+@profile
+@cache_data
+def get_sample_linkage(dataset, metric="euclidean", method="complete"):
+    # uses the distances shared with PCoA and PERMANOVA
+    return linkage(get_distance_matrix(dataset, metric), method=method)
+
+
+@profile
+@cache_data
+def get_feature_linkage(dataset, metric="euclidean", method="complete", max_features=None):
+    # memory grows with features squared (condensed float64 distances), see get_top_variance_features
+    data = get_top_variance_features(dataset.get_data(np.float32), max_features)
+    return linkage(data.to_numpy(dtype=np.float64).T, method=method, metric=metric)
+
+
+@profile
+@cache_resource
+def get_dendrogram(dataset, label_pos="bottom", metric="euclidean", method="complete"):
+    # plotly computes distances and linkage itself, hand it the cached ones instead
+    fig = ff.create_dendrogram(
+        dataset.X,
+        labels=list(dataset.samples),
+        distfun=lambda x: get_distance_matrix(dataset, metric),
+        linkagefun=lambda x: get_sample_linkage(dataset, metric, method),
+    )
     fig.update_layout(template="plotly_white")
     fig.update_xaxes(side=label_pos)
     return fig
 
 
-@st.cache_resource
-def get_heatmap(data):
-    # SORT DATA TO CREATE HEATMAP
+@profile
+@cache_data
+def get_clustered_data(dataset, metric="euclidean", method="complete", max_features=None):
+    """Features (rows) x samples (columns) in clustered order and the feature linkage."""
+    # each linkage is computed once, the leaves give the clustered order of samples and features
+    sample_order = leaves_list(get_sample_linkage(dataset, metric, method))
+    data = get_top_variance_features(dataset.get_data(np.float32), max_features)
+    feature_linkage = get_feature_linkage(dataset, metric, method, max_features)
+
+    # features as rows, samples as columns
+    ord_ft = data.iloc[sample_order, leaves_list(feature_linkage)].T
+    ord_ft.columns.name = "Filename"
 
-    # Compute linkage matrix from distances for hierarchical clustering
-    linkage_data_ft = linkage(data, method="complete", metric="euclidean")
-    linkage_data_samples = linkage(data.T, method="complete", metric="euclidean")
+    # Append string prefix to numeric indeces
+    ord_ft.index = pd.Index(["m_"+x if x.isnumeric() else x for x in ord_ft.index.astype(str)], name="metabolite")
+    return ord_ft, feature_linkage
 
-    # Create a dictionary of data structures computed to render the dendrogram.
-    # We will use dict['leaves']
-    cluster_samples = dendrogram(linkage_data_ft, no_plot=True)
-    cluster_ft = dendrogram(linkage_data_samples, no_plot=True)
 
-    # Create dataframe with sorted samples
-    ord_samp = data.copy()
-    ord_samp.reset_index(inplace=True)
-    ord_samp = ord_samp.reindex(cluster_samples["leaves"])
-    ord_samp.rename(columns={"index": "Filename"}, inplace=True)
-    ord_samp.set_index("Filename", inplace=True)
+def get_feature_branches(feature_linkage, n_branches):
+    """Cut the feature dendrogram into at most n_branches branches, numbered from top to bottom of the heatmap."""
+    branches = fcluster(feature_linkage, n_branches, criterion="maxclust")[leaves_list(feature_linkage)]
+    return pd.factorize(branches)[0] + 1
 
-    # Create dataframe with sorted features
-    ord_ft = ord_samp.T.reset_index()
-    ord_ft = ord_ft.reindex(cluster_ft["leaves"])
 
-    ord_ft.drop(columns=["metabolite"], inplace=True)
-    
-    # Append string prefix to numeric indeces
-    ord_ft.index = pd.Index(["m_"+x if x.isnumeric() else x for x in ord_ft.index.astype(str)])
-    
-    # Heatmap
-    fig = px.imshow(
-        ord_ft,
-        y=ord_ft.index.tolist(),
-        x=list(ord_ft.columns),
-        text_auto=False,
-        aspect="auto",
-        color_continuous_scale="PuOr_r"
-        #range_color=[ord_ft.min().min(), ord_ft.max().max()],
-    )
+def get_heatmap_fig(df, height=1200):
+    if df.size <= MAX_HEATMAP_CELLS:
+        fig = px.imshow(
+            df,
+            y=df.index.tolist(),
+            x=list(df.columns),
+            text_auto=False,
+            aspect="auto",
+            color_continuous_scale="PuOr_r"
+        )
+    else:
+        # large heatmaps are sent to the browser as one PNG image instead of a JSON value per cell
+        values = df.to_numpy(dtype=np.float64)
+        zmin, zmax = np.nanmin(values), np.nanmax(values)
+        colors = np.array(
+            [px.colors.unlabel_rgb(c) for c in px.colors.sample_colorscale(px.colors.get_colorscale("PuOr_r"), 256)],
+            dtype=np.uint8,
+        )
+        scaled = np.nan_to_num((values - zmin) / ((zmax - zmin) or 1) * 255).astype(np.uint8)
+        fig = px.imshow(colors[scaled], binary_string=True, aspect="auto")
+        # invisible trace for the color bar
+        fig.add_trace(
+            go.Scatter(
+                x=[None],
+                y=[None],
+                mode="markers",
+                showlegend=False,
+                marker={"colorscale": "PuOr_r", "cmin": zmin, "cmax": zmax, "showscale": True},
+            )
+        )
+        fig.update_xaxes(tickmode="array", tickvals=list(range(df.shape[1])), ticktext=list(df.columns))
+        fig.update_yaxes(showticklabels=False)
 
     fig.update_layout(
-        autosize=False, width=700, height=1200, xaxis_title="", yaxis_title="",
+        autosize=False, width=700, height=height, xaxis_title="", yaxis_title="",
     )
 
     # fig.update_yaxes(visible=False)
     fig.update_xaxes(tickangle=35)
-    return fig, ord_ft
+    return fig
+
+
+@profile
+@cache_resource
+def get_heatmap(dataset, metric="euclidean", method="complete", max_features=None):
+    ord_ft, _ = get_clustered_data(dataset, metric, method, max_features)
+    return get_heatmap_fig(ord_ft), ord_ft
+
+
+@profile
+@cache_resource
+def get_branch_heatmap(dataset, metric="euclidean", method="complete", max_features=None, n_branches=50):
+    """Overview heatmap with the mean intensity of each dendrogram branch and the branch of every feature."""
+    ord_ft, feature_linkage = get_clustered_data(dataset, metric, method, max_features)
+    branches = pd.Series(get_feature_branches(feature_linkage, n_branches), index=ord_ft.index, name="branch")
+    df = ord_ft.groupby(branches.to_numpy(), sort=False).mean()
+    sizes = branches.value_counts()
+    df.index = pd.Index([f"branch {b} (n={sizes[b]})" for b in df.index], name="branch")
+    return get_heatmap_fig(df, height=max(400, min(1200, 20 * len(df)))), branches
+
+
+@profile
+@cache_resource
+def get_branch_detail_heatmap(dataset, metric, method, max_features, n_branches, branch):
+    # all features of one dendrogram branch at full resolution
+    ord_ft, _ = get_clustered_data(dataset, metric, method, max_features)
+    _, branches = get_branch_heatmap(dataset, metric, method, max_features, n_branches)
+    df = ord_ft[branches.to_numpy() == branch]
+    return get_heatmap_fig(df, height=max(400, min(1200, 15 * len(df)))), df
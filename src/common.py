@@ -1,8 +1,12 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
 import io
+from contextlib import contextmanager
 import uuid
 import base64
+from .diskcache import content_hash, file_content_hash, read_cached_table, write_cached_table, clear_table_cache, clear_result_store
+from .profiling import profile, profile_expander
 
 dataframe_names = ("md",
                    "data",
@@ -36,6 +40,8 @@ def clear_cache_button():
             st.cache_data.clear()
         if hasattr(st, "cache_resource"):
             st.cache_resource.clear()
+        clear_table_cache()
+        clear_result_store()
         st.success("Cache cleared!")
 
 def page_setup():
@@ -70,6 +76,8 @@ def page_setup():
             v_space(1)
             clear_cache_button()
 
+        profile_expander()
+
         # Display two images side by side in the sidebar
         v_space(1)
         col1, col2 = st.columns(2)
@@ -137,29 +145,62 @@ def v_space(n, col=None):
             st.write("")
 
 
+separators = {"txt": "\t", "tsv": "\t", "csv": ","}
+
+
+def read_file(file):
+    """Return file extension and raw bytes of a file path or uploaded file."""
+    if type(file) == str:
+        with open(file, "rb") as f:
+            return file.split(".")[-1], f.read()
+    return file.name.split(".")[-1], file.getvalue()
+
+
+@contextmanager
+def open_binary(file):
+    """File extension and binary file object of a file path or uploaded file, without reading the content."""
+    if type(file) == str:
+        with open(file, "rb") as f:
+            yield file.split(".")[-1], f
+    else:
+        file.seek(0)
+        yield file.name.split(".")[-1], file
+
+
+@profile
 def open_df(file):
-    separators = {"txt": "\t", "tsv": "\t", "csv": ","}
     try:
-        if type(file) == str:
-            ext = file.split(".")[-1]
-            if ext != "xlsx":
-                df = pd.read_csv(file, sep=separators[ext])
-            else:
-                df = pd.read_excel(file)
+        ext, content = read_file(file)
+        # parsed tables are cached on disk as Parquet, keyed by file content and type
+        key = content_hash(ext, content)
+        df = read_cached_table(key)
+        if df is not None:
+            return df
+        if ext != "xlsx":
+            df = pd.read_csv(io.BytesIO(content), sep=separators[ext])
         else:
-            ext = file.name.split(".")[-1]
-            if ext != "xlsx":
-                df = pd.read_csv(file, sep=separators[ext])
-            else:
-                df = pd.read_excel(file)
+            df = pd.read_excel(io.BytesIO(content))
         # sometimes dataframes get saved with unnamed index, that needs to be removed
         if "Unnamed: 0" in df.columns:
             df.drop("Unnamed: 0", inplace=True, axis=1)
+        write_cached_table(key, df)
         return df
     except:
         return pd.DataFrame()
 
 
+def get_metabolite_index(mz, rt, row_id=None, mz_decimals=5, rt_decimals=2, sep="@"):
+    """Metabolite names "<row ID>_<m/z><sep><RT>" built with numpy string ops for whole columns at once."""
+    index = np.char.add(
+        np.char.add(np.round(np.asarray(mz, dtype=float), mz_decimals).astype(str), sep),
+        np.round(np.asarray(rt, dtype=float), rt_decimals).astype(str),
+    )
+    if row_id is not None:
+        index = np.char.add(np.char.add(np.asarray(row_id).astype(str), "_"), index)
+    return pd.Index(index.astype(object), name="metabolite")
+
+
+@profile
 def show_table(df, title="", col="", download=True):
     if col:
         col = col
@@ -168,6 +209,7 @@ def show_table(df, title="", col="", download=True):
     col.dataframe(df, use_container_width=True)
 
 
+@profile
 def show_fig(fig, download_name, container_width=True):
     st.plotly_chart(
         fig,
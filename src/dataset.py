@@ -0,0 +1,176 @@
+import functools
+import inspect
+import json
+import sys
+import streamlit as st
+import pandas as pd
+import numpy as np
+from .groupstats import encode_groups
+from .diskcache import content_hash, read_result, write_result
+from .profiling import set_cache_status
+
+
+# results kept per cached analysis function, the least recently used ones are dropped first
+MAX_CACHE_ENTRIES = 32
+
+
+class AnalysisDataset:
+    """Data (samples x features) and meta data as submitted for statistics, prepared once for all tests.
+
+    Intensities are kept as one contiguous float32 matrix, every meta data attribute is integer
+    encoded and the row indices of each group are precomputed, so tests slice by index. PCA, PCoA
+    and clustering convert the intensities to float64 on demand (get_data). The fingerprint
+    (of the float32 intensities, sample and feature names and meta data) identifies the dataset
+    in the caches of all analysis functions.
+    """
+
+    def __init__(self, data, md):
+        # the submitted tables, held by the session anyway, to tell when they change (not used for analysis)
+        self.source_data = data
+        self.samples = data.index
+        self.features = data.columns
+        self.X = np.ascontiguousarray(data.to_numpy(dtype=np.float32))
+        # md is reindexed to the samples
+        self.source_md = md
+        self.md = md.reindex(data.index)
+        self.codes, self.groups, self.group_rows = {}, {}, {}
+        for attribute in self.md.columns:
+            codes, groups = encode_groups(self.md[attribute])
+            self.codes[attribute] = codes
+            self.groups[attribute] = groups
+            self.group_rows[attribute] = {group: np.flatnonzero(codes == i) for i, group in enumerate(groups)}
+        self.fingerprint = content_hash(
+            # hashed in place, without a copy of the matrix
+            memoryview(self.X),
+            f"{self.X.dtype}{self.X.shape}",
+            pd.util.hash_pandas_object(self.samples.to_series()).to_numpy().tobytes(),
+            pd.util.hash_pandas_object(self.features.to_series()).to_numpy().tobytes(),
+            pd.util.hash_pandas_object(self.md.astype(str), index=False).to_numpy().tobytes(),
+            "\t".join(map(str, self.md.columns)),
+        )
+
+    def get_data(self, dtype=np.float64):
+        """Intensities as DataFrame (samples x features), converted from the float32 matrix on every call."""
+        return pd.DataFrame(self.X.astype(dtype), index=self.samples, columns=self.features, copy=False)
+
+    def select(self, attribute, groups=None, columns=None):
+        """Intensities, group codes and names of the samples in the given groups (default: all with a label).
+
+        Rows are ordered by group, within a group in sample order.
+        """
+        groups = self.groups[attribute] if groups is None else np.asarray(groups)
+        rows = [self.group_rows[attribute][group] for group in groups]
+        codes = np.repeat(np.arange(len(groups)), [len(r) for r in rows])
+        rows = np.concatenate(rows)
+        X = self.X[rows] if columns is None else self.X[np.ix_(rows, columns)]
+        return X, codes, groups
+
+    def get_labelled(self, attribute):
+        """Intensities, group codes and names of all samples with a label, in sample order."""
+        rows = np.flatnonzero(self.codes[attribute] >= 0)
+        return self.X[rows], self.codes[attribute][rows], self.groups[attribute]
+
+    def get_columns(self, metabolites):
+        return self.features.get_indexer(metabolites)
+
+    def get_feature(self, attribute, metabolite, groups=None):
+        """Intensities of one metabolite with the group of every sample, e.g. for box plots."""
+        X, codes, groups = self.select(attribute, groups, self.get_columns([metabolite]))
+        return pd.DataFrame({attribute: groups[codes], metabolite: X[:, 0]})
+
+
+# the caches hash the precomputed fingerprint instead of the whole dataset
+hash_funcs = {AnalysisDataset: lambda dataset: dataset.fingerprint}
+
+
+def mark_miss(func):
+    # runs only on a cache miss, recorded by the profiling panel
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        set_cache_status("miss")
+        return func(*args, **kwargs)
+
+    return wrapper
+
+
+def cache_data(func):
+    """st.cache_data keyed on dataset fingerprint and parameters, bounded to MAX_CACHE_ENTRIES (LRU)."""
+    return st.cache_data(mark_miss(func), max_entries=MAX_CACHE_ENTRIES, hash_funcs=hash_funcs)
+
+
+def cache_resource(func):
+    # same for figures, which are not copied on every call
+    return st.cache_resource(mark_miss(func), max_entries=MAX_CACHE_ENTRIES, hash_funcs=hash_funcs)
+
+
+def get_argument_key(value):
+    # datasets by fingerprint, (result) tables by content, everything else by its repr
+    if isinstance(value, AnalysisDataset):
+        return value.fingerprint
+    if isinstance(value, pd.DataFrame):
+        return content_hash(pd.util.hash_pandas_object(value).to_numpy().tobytes(), repr(list(value.columns)))
+    return repr(value)
+
+
+def get_code_version(module_name):
+    """Hash of the source of a module and of the modules of its package it imports from.
+
+    Part of the result store keys, a code update computes results again.
+    """
+    module = sys.modules[module_name]
+    names = {module_name}
+    if module.__package__:
+        for value in vars(module).values():
+            name = value.__name__ if inspect.ismodule(value) else getattr(value, "__module__", None)
+            if isinstance(name, str) and name.startswith(module.__package__ + "."):
+                names.add(name)
+    return content_hash(*(inspect.getsource(sys.modules[name]) for name in sorted(names)))
+
+
+def store_results(func):
+    """Keep the results of func in the on-disk result store (see diskcache), shared by all sessions and restarts.
+
+    Results are keyed on function name, code version of its module (see get_code_version),
+    dataset fingerprint and the other arguments. Arguments with a leading underscore (e.g. the number
+    of CPU cores) don't change the result and are left out of the key, like st.cache_data does.
+    Results of unseeded runs differ on every call and are not stored: random_seed None, or a seed
+    drawn for a single run with the _store argument set to False.
+    Use below cache_data, the store is only read when the result is not in memory.
+    """
+    signature = inspect.signature(func)
+    name = f"{func.__module__.split('.')[-1]}.{func.__name__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        if arguments.arguments.get("_store") is False or (
+            "random_seed" in arguments.arguments and arguments.arguments["random_seed"] is None
+        ):
+            return func(*args, **kwargs)
+        fingerprint = "".join(v.fingerprint for v in arguments.arguments.values() if isinstance(v, AnalysisDataset))
+        parameters = {
+            k: get_argument_key(v)
+            for k, v in arguments.arguments.items()
+            if not isinstance(v, AnalysisDataset) and not k.startswith("_")
+        }
+        # the module is fully imported by the time of the first call
+        key = content_hash(name, get_code_version(func.__module__), fingerprint, repr(parameters))
+        result = read_result(key)
+        if result is not None:
+            set_cache_status("disk")
+            return result
+        result = func(*args, **kwargs)
+        write_result(key, result, name, fingerprint, json.dumps(parameters))
+        return result
+
+    return wrapper
+
+
+def get_dataset():
+    """The analysis dataset of the submitted data, built (and fingerprinted) again only if data or meta data changed."""
+    dataset = st.session_state.get("dataset")
+    if dataset is None or dataset.source_data is not st.session_state.data or dataset.source_md is not st.session_state.md:
+        dataset = AnalysisDataset(st.session_state.data, st.session_state.md)
+        st.session_state["dataset"] = dataset
+    return dataset
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import closing
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# local on-disk cache, survives reruns, page switches and server restarts
+CACHE_DIR = Path(".cache")
+TABLE_CACHE_DIR = CACHE_DIR / "tables"
+MAX_CACHE_SIZE = 2 * 1024**3  # bytes
+MAX_CACHE_AGE = 7 * 24 * 60 * 60  # seconds
+# analysis results shared by all sessions, Parquet files indexed in SQLite
+RESULT_CACHE_DIR = CACHE_DIR / "results"
+RESULT_INDEX = RESULT_CACHE_DIR / "index.sqlite"
+MAX_RESULT_CACHE_SIZE = 1024**3  # bytes
+
+
+def content_hash(*parts):
+    """Hash of the given bytes/str parts, used as cache key."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode() if isinstance(part, str) else part)
+    return h.hexdigest()
+
+
+def file_content_hash(file, *parts, block_size=2**20):
+    """content_hash of the parts followed by the content of a binary file, read in blocks."""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(part.encode() if isinstance(part, str) else part)
+    for block in iter(lambda: file.read(block_size), b""):
+        h.update(block)
+    file.seek(0)
+    return h.hexdigest()
+
+
+def evict_cache(directory, max_size=MAX_CACHE_SIZE, max_age=MAX_CACHE_AGE):
+    """Delete cache files older than max_age and the least recently used ones above max_size."""
+    files = []
+    for path in Path(directory).glob("*.parquet"):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        files.append((stat.st_mtime, stat.st_size, path))
+    files.sort()  # least recently used first
+
+    now = time.time()
+    total_size = sum(size for _, size, _ in files)
+    for mtime, size, path in files:
+        if now - mtime > max_age or total_size > max_size:
+            path.unlink(missing_ok=True)
+            total_size -= size
+
+
+def read_cached_table(key):
+    """Return the cached DataFrame for key or None."""
+    path = TABLE_CACHE_DIR / f"{key}.parquet"
+    if not path.exists():
+        return None
+    try:
+        df = pd.read_parquet(path)
+    except Exception:
+        return None
+    # mark as recently used for eviction
+    os.utime(path)
+    return df
+
+
+def write_cached_table(key, df):
+    """Store df as Parquet under key; tables that can not be stored as Parquet are skipped."""
+    TABLE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    path = TABLE_CACHE_DIR / f"{key}.parquet"
+    tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+    try:
+        df.to_parquet(tmp)
+        os.replace(tmp, path)
+    except Exception:
+        tmp.unlink(missing_ok=True)
+        return
+    evict_cache(TABLE_CACHE_DIR)
+
+
+def clear_table_cache():
+    for path in TABLE_CACHE_DIR.glob("*.parquet"):
+        path.unlink(missing_ok=True)
+
+
+def open_result_index():
+    RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(RESULT_INDEX, timeout=30)
+    con.execute(
+        """CREATE TABLE IF NOT EXISTS results (
+            key TEXT PRIMARY KEY,
+            function TEXT,
+            fingerprint TEXT,
+            parameters TEXT,
+            layout TEXT,
+            size INTEGER,
+            last_used REAL
+        )"""
+    )
+    return con
+
+
+def to_layout(result):
+    """Split a result into DataFrames (stored as Parquet) and a JSON layout with the plain values."""
+    tables, parts = [], []
+    for part in result if isinstance(result, tuple) else (result,):
+        if isinstance(part, pd.DataFrame):
+            parts.append({"table": len(tables)})
+            tables.append(part)
+        elif part is None or isinstance(part, (str, bool, int, float)):
+            parts.append({"value": part})
+        elif isinstance(part, np.generic):
+            parts.append({"value": part.item()})
+        else:
+            return None, None
+    return tables, {"tuple": isinstance(result, tuple), "parts": parts}
+
+
+def read_result(key):
+    """Return the stored result for key (a DataFrame or a tuple of DataFrames and plain values) or None."""
+    if not RESULT_INDEX.exists():
+        return None
+    try:
+        with closing(open_result_index()) as con, con:
+            row = con.execute("SELECT layout FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            layout = json.loads(row[0])
+            parts = [
+                pd.read_parquet(RESULT_CACHE_DIR / f"{key}_{part['table']}.parquet") if "table" in part else part["value"]
+                for part in layout["parts"]
+            ]
+            # mark as recently used for eviction
+            con.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+    except Exception:
+        return None
+    return tuple(parts) if layout["tuple"] else parts[0]
+
+
+def write_result(key, result, function="", fingerprint="", parameters=""):
+    """Store a DataFrame or a tuple of DataFrames and plain values (str, numbers, None) under key.
+
+    Results of other types and tables that can not be stored as Parquet are skipped.
+    """
+    tables, layout = to_layout(result)
+    if tables is None:
+        return
+    paths = [RESULT_CACHE_DIR / f"{key}_{i}.parquet" for i in range(len(tables))]
+    try:
+        RESULT_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for df, path in zip(tables, paths):
+            # unique per write, sessions of one server are threads of the same process
+            tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+            try:
+                df.to_parquet(tmp)
+                os.replace(tmp, path)
+            finally:
+                tmp.unlink(missing_ok=True)
+        with closing(open_result_index()) as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, function, fingerprint, parameters, json.dumps(layout), sum(p.stat().st_size for p in paths), time.time()),
+            )
+    except Exception:
+        # files already replaced may be indexed by a write of the same key in another session, keep them
+        return
+    try:
+        evict_results()
+    except sqlite3.Error:
+        # e.g. index locked by another process for too long, evicted with the next result
+        pass
+
+
+def evict_results(max_size=MAX_RESULT_CACHE_SIZE):
+    """Delete the least recently used results above max_size."""
+    with closing(open_result_index()) as con, con:
+        rows = con.execute("SELECT key, layout, size FROM results ORDER BY last_used DESC").fetchall()
+        total_size = 0
+        for key, layout, size in rows:
+            total_size += size
+            if total_size > max_size:
+                delete_result(con, key, layout)
+
+
+def delete_result(con, key, layout):
+    for part in json.loads(layout)["parts"]:
+        if "table" in part:
+            (RESULT_CACHE_DIR / f"{key}_{part['table']}.parquet").unlink(missing_ok=True)
+    con.execute("DELETE FROM results WHERE key = ?", (key,))
+
+
+def clear_result_store():
+    if RESULT_INDEX.exists():
+        with closing(open_result_index()) as con, con:
+            con.execute("DELETE FROM results")
+    for path in RESULT_CACHE_DIR.glob("*.parquet"):
+        path.unlink(missing_ok=True)
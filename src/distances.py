@@ -0,0 +1,15 @@
+import numpy as np
+from scipy.spatial import distance
+from .profiling import profile
+from .dataset import cache_data
+
+
+@profile
+@cache_data
+def get_distance_matrix(dataset, metric="euclidean"):
+    """Condensed pairwise distances between samples (rows), cached per dataset and metric.
+
+    Shared by PCoA, PERMANOVA and hierarchical clustering of samples, use
+    distance.squareform to get the square matrix.
+    """
+    return distance.pdist(dataset.X.astype(np.float64), metric)
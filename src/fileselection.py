@@ -1,8 +1,10 @@
 import streamlit as st
+import numpy as np
 from .common import *
 from gnpsdata import taskresult
 from gnpsdata import workflow_fbmn
 import urllib
+from .profiling import profile
 
 patterns = [
     ["m/z", "mz", "mass over charge"],
@@ -28,17 +30,13 @@ def get_new_index(df):
         column_names = [col[0] for col in cols if col]
         if not column_names:
             return df, "no matching columns"
-        # set metabolites column with index as default
-        df["metabolite"] = df.index
+        # metabolite names from m/z and RT (and row ID), keep the index otherwise
         if len(column_names) == 2:
-            df["metabolite"] = df[column_names[0]].round(5).astype(str)
-            if column_names[1]:
-                df["metabolite"] = (
-                    df["metabolite"] + "@" + df[column_names[1]].round(2).astype(str)
-                )
-            if "row ID" in df.columns:
-                df["metabolite"] = df["row ID"].astype(str) + "_" + df["metabolite"]
-        df.set_index("metabolite", inplace=True)
+            df.index = get_metabolite_index(
+                df[column_names[0]], df[column_names[1]], df["row ID"] if "row ID" in df.columns else None
+            )
+        else:
+            df.index.name = "metabolite"
     except:
         return df, "fail"
     return df, "success"
@@ -54,6 +52,7 @@ def load_example():
     return ft, md
 
 
+@profile
 def load_from_gnps(task_id, cmn=False):
 
     try: # GNPS2 will run here
@@ -96,7 +95,7 @@ def load_from_gnps(task_id, cmn=False):
         ft = ft.drop(columns=["row m/z", "row retention time", "row ID"])
 
     else:
-        index_with_mz_RT = ft.apply(lambda x: f'{x["row ID"]}_{round(x["row m/z"], 4)}_{round(x["row retention time"], 2)}', axis=1)
+        index_with_mz_RT = get_metabolite_index(ft["row m/z"], ft["row retention time"], ft["row ID"], mz_decimals=4, sep="_")
         ft.index = index_with_mz_RT
         if 'df_gnps_annotations' in st.session_state:
             st.session_state["df_gnps_annotations"].index = index_with_mz_RT
@@ -107,13 +106,82 @@ def load_from_gnps(task_id, cmn=False):
     return ft, md
 
 
+def get_ft_columns(columns):
+    """Row ID, m/z and RT column names plus the sample peak area columns of a MZmine table (None if not one)."""
+    mz, rt = [[col for col in columns if string_overlap(col.lower(), pattern)] for pattern in patterns]
+    samples = [col for col in columns if ".mzML" in col or ".mzXML" in col]
+    if "metabolite" in columns or "row ID" not in columns or not mz or not rt or not samples:
+        return None
+    return "row ID", mz[0], rt[0], samples
+
+
+def open_ft_chunked(ext, file, columns, chunksize=10000, progress=None):
+    """Stream a quantification table in chunks, keeping only row ID, m/z, RT and
+    peak area columns with intensities as float32 and metabolite index built per chunk.
+
+    progress is called with the fraction of the file read and the number of features so far.
+    """
+    row_id, mz, rt, samples = columns
+    size = max(file.seek(0, io.SEEK_END), 1)
+    file.seek(0)
+    chunks, n_read = [], 0
+    reader = pd.read_csv(
+        file,
+        sep=separators[ext],
+        usecols=[row_id, mz, rt] + samples,
+        dtype={col: np.float32 for col in samples},
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        # same metabolite names as get_new_index
+        chunk.index = get_metabolite_index(chunk[mz], chunk[rt], chunk[row_id])
+        chunks.append(chunk)
+        n_read += len(chunk)
+        if progress is not None:
+            progress(min(file.tell() / size, 1.0), n_read)
+    ft = pd.concat(chunks)[[row_id, mz, rt] + samples]
+    return ft
+
+
+def open_ft(ft_file, progress=None):
+    """Read a MZmine quantification table in chunks (cached on disk), None for other tables.
+
+    The file is not read into memory as a whole, see open_ft_chunked for progress.
+    """
+    try:
+        with open_binary(ft_file) as (ext, file):
+            if ext not in separators:
+                return None
+            columns = get_ft_columns(pd.read_csv(file, sep=separators[ext], nrows=0).columns.tolist())
+            if columns is None:
+                return None
+            file.seek(0)
+            key = file_content_hash(file, "ft", ext)
+            ft = read_cached_table(key)
+            if ft is None:
+                ft = open_ft_chunked(ext, file, columns, progress=progress)
+                write_cached_table(key, ft)
+            return ft
+    except:
+        return None
+
+
+@profile
 def load_ft(ft_file):
-    ft = open_df(ft_file)
+    # large MZmine tables are streamed, keeping only the columns needed later on
+    progress = st.progress(0.0, text="Reading quantification table...")
+    ft = open_ft(
+        ft_file,
+        lambda fraction, n_read: progress.progress(fraction, text=f"Reading quantification table... {n_read} features"),
+    )
+    progress.empty()
+    if ft is None:
+        ft = open_df(ft_file)
     ft = ft.dropna(axis=1)
     # determining index with m/z, rt and adduct information
     if "metabolite" in ft.columns:
         ft.index = ft["metabolite"]
-    else:
+    elif ft.index.name != "metabolite":
         v_space(2)
         st.warning(
             """⚠️ **Feature Table**
@@ -142,6 +210,7 @@ Please select the correct one or try to automatically create an index based on R
     return ft
 
 
+@profile
 def load_md(md_file):
     md = open_df(md_file)
     # we need file names as index, if they don't exist throw a warning and let user chose column
@@ -0,0 +1,42 @@
+import pandas as pd
+import numpy as np
+
+
+def encode_groups(labels):
+    """Return integer group codes per sample (-1 for missing labels) and the group names."""
+    codes, groups = pd.factorize(pd.Series(labels), sort=True)
+    return codes, np.asarray(groups)
+
+
+def group_sums(X, codes, n_groups):
+    """Column sums of X per group, computed as a (groups x samples) one-hot matrix product."""
+    one_hot = np.zeros((n_groups, X.shape[0]))
+    one_hot[codes, np.arange(X.shape[0])] = 1
+    return one_hot @ X
+
+
+def rank_data(X):
+    """Average ranks of every column of X (like scipy.stats.rankdata) and the tie term sum(t^3 - t) per column.
+
+    All columns are ranked with a single argsort; tie runs are detected on the sorted
+    matrix laid out column by column, with a padding slot so runs never span two columns.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, p = X.shape
+    order = np.argsort(X, axis=0, kind="mergesort")
+    sorted_X = np.take_along_axis(X, order, axis=0).T
+
+    new_run = np.ones((p, n + 1), dtype=bool)
+    new_run[:, 1:n] = sorted_X[:, 1:] != sorted_X[:, :-1]
+    starts = np.append(np.flatnonzero(new_run), p * (n + 1))
+    lengths = np.diff(starts)
+    starts = starts[:-1]
+
+    # average rank of a run is its 1-based start position plus half its extent
+    avg_rank = starts % (n + 1) + 1 + (lengths - 1) / 2
+    sorted_ranks = np.repeat(avg_rank, lengths).reshape(p, n + 1)[:, :n]
+    ranks = np.empty_like(X)
+    np.put_along_axis(ranks, order, sorted_ranks.T, axis=0)
+
+    ties = np.bincount(starts // (n + 1), weights=lengths**3 - lengths, minlength=p)
+    return ranks, ties
@@ -1,16 +1,34 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import pingouin as pg
 import plotly.express as px
-import plotly.graph_objects as go
-from scipy.stats import kruskal
-import scikit_posthocs as sp
-
-def gen_kruskal_data(group_data):
-    for col in group_data[0].columns:
-        statistic, p = kruskal(*[df[col] for df in group_data])
-        yield col, p, statistic
+import scipy.stats as stats
+from .groupstats import group_sums, rank_data
+from .dataset import cache_data, cache_resource, store_results
+from .profiling import profile
+
+def get_kruskal_data(X, codes, groups, columns):
+    """Kruskal-Wallis H-test with tie correction for all feature columns at once."""
+    X = np.asarray(X, dtype=np.float64)
+    n, k = X.shape[0], len(groups)
+
+    ranks, ties = rank_data(X)
+    n_group = np.bincount(codes, minlength=k)
+    rank_sums = group_sums(ranks, codes, k)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        h = 12 / (n * (n + 1)) * (rank_sums**2 / n_group[:, None]).sum(axis=0) - 3 * (n + 1)
+        h = h / (1 - ties / (n**3 - n))
+    h[np.isnan(X).any(axis=0)] = np.nan
+    p = stats.chi2.sf(h, k - 1)
+
+    return pd.DataFrame(
+        {
+            "metabolite": np.asarray(columns).astype(str),
+            "p": p.astype(np.float32),
+            "statistic": h.astype(np.float32),
+        }
+    )
 
 def add_p_correction_to_kruskal(df, correction):
     # add Bonferroni corrected p-values for multiple testing correction
@@ -25,26 +43,19 @@ def add_p_correction_to_kruskal(df, correction):
     return df
 
 
-@st.cache_data
-def kruskal_wallis(df, attribute, correction):
-    df = pd.concat([df, st.session_state.md[[attribute]]], axis=1)
-    groups = df[attribute].unique()
-    group_data = [df[df[attribute] == group] for group in groups]
-
-    df = pd.DataFrame(
-        np.fromiter(
-            gen_kruskal_data(group_data),
-            dtype=[("metabolite", "U100"), ("p", "f"), ("statistic", "f")],
-        )
-    )
+@profile
+@cache_data
+@store_results
+def kruskal_wallis(dataset, attribute, correction):
+    df = get_kruskal_data(*dataset.select(attribute), dataset.features)
     df = df.dropna()
     df = add_p_correction_to_kruskal(df, correction)
-    df = df[df["metabolite"] != attribute]
     return df
 
 
-@st.cache_resource
-def get_kruskal_plot(kruskal):
+@profile
+@cache_resource
+def get_kruskal_plot(kruskal, attribute):
     # first plot insignificant features
     fig = px.scatter(
         x=kruskal[kruskal["significant"] == False]["statistic"].apply(np.log),
@@ -70,7 +81,7 @@ def get_kruskal_plot(kruskal):
     fig.update_layout(
         font={"color": "grey", "size": 12, "family": "Sans"},
         title={
-            "text": f"Kruskal Wallis - {st.session_state.kruskal_attribute.upper()}",
+            "text": f"Kruskal Wallis - {attribute.upper()}",
             "font_color": "#3E3D53"
         },
         xaxis_title="log(H)",
@@ -81,13 +92,11 @@ def get_kruskal_plot(kruskal):
     return fig
 
 
-@st.cache_resource
-def get_metabolite_boxplot(kruskal, metabolite):
-    attribute = st.session_state.kruskal_attribute
+@profile
+@cache_resource
+def get_metabolite_boxplot(dataset, kruskal, attribute, metabolite):
     p_value = kruskal.set_index("metabolite")._get_value(metabolite, "p-corrected")
-    df = pd.concat([st.session_state.data, st.session_state.md], axis=1)[
-        [attribute, metabolite]
-    ]
+    df = dataset.get_feature(attribute, metabolite)
     title = f"{metabolite}<br>corrected p-value: {str(p_value)[:6]}"
     fig = px.box(
         df,
@@ -109,12 +118,42 @@ def get_metabolite_boxplot(kruskal, metabolite):
     return fig
 
 
-def gen_pairwise_dunn(group_data):
-    """Yield results for pairwise dunn test for all metabolites between two options within the attribute."""
-    for col in group_data[0].columns:
-        # posthoc_dunn returns a 2x2 matrix with p values, we just need one with from the comparison
-        p = sp.posthoc_dunn([df[col] for df in group_data]).iloc[0, 1]
-        yield (col, p)
+def get_dunn_data(X, codes, groups, columns, pairs=None):
+    """Dunn's test with tie correction for all feature columns at once.
+
+    Ranks are computed over all samples with a label. By default every pair of groups is
+    compared, otherwise only the given (A, B) pairs. Returns one row per metabolite and pair.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, k = X.shape[0], len(groups)
+
+    ranks, ties = rank_data(X)
+    n_group = np.bincount(codes, minlength=k)
+    mean_ranks = group_sums(ranks, codes, k) / n_group[:, None]
+
+    if pairs is None:
+        a, b = np.triu_indices(k, 1)
+    else:
+        index = {group: i for i, group in enumerate(groups)}
+        a = np.array([index[pair[0]] for pair in pairs], dtype=int)
+        b = np.array([index[pair[1]] for pair in pairs], dtype=int)
+
+    # (pairs x features) z values
+    se = np.sqrt((n * (n + 1) / 12 - ties / (12 * (n - 1))) * (1 / n_group[a] + 1 / n_group[b])[:, None])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        z = (mean_ranks[a] - mean_ranks[b]) / se
+    p = 2 * stats.norm.sf(np.abs(z))
+
+    n_features = X.shape[1]
+    return pd.DataFrame(
+        {
+            "stats_metabolite": np.tile(np.asarray(columns).astype(str), len(a)),
+            "p": p.ravel().astype(np.float32),
+            "z": z.ravel().astype(np.float32),
+            "A": np.repeat(groups[a], n_features),
+            "B": np.repeat(groups[b], n_features),
+        }
+    )
 
 
 def add_p_value_correction_to_dunns(dunn, correction):
@@ -131,25 +170,16 @@ def add_p_value_correction_to_dunns(dunn, correction):
     return dunn
 
 
-@st.cache_data
-def dunn(df, attribute, elements, correction):
+@profile
+@cache_data
+@store_results
+def dunn(dataset, df, attribute, elements, correction):
     significant_metabolites = df[df["significant"]]["metabolite"]
-    data = pd.concat(
-        [
-            st.session_state.data.loc[:, significant_metabolites],
-            st.session_state.md[attribute],
-        ],
-        axis=1,
-    )
-    data = data[data[attribute].isin(elements)]
-    dunn = pd.DataFrame(
-        np.fromiter(
-            gen_pairwise_dunn([data[data[attribute] == element].drop(columns=[attribute]) for element in elements]),
-            dtype=[
-                ("stats_metabolite", "U100"),
-                ("p", "f")
-            ],
-        )
+    # ranks over the samples of the two groups only
+    dunn = get_dunn_data(
+        *dataset.select(attribute, sorted(elements), dataset.get_columns(significant_metabolites)),
+        significant_metabolites,
+        pairs=[tuple(elements)],
     )
     dunn = dunn.dropna()
     dunn = add_p_value_correction_to_dunns(dunn, correction)
@@ -1,29 +1,67 @@
-import streamlit as st
-from sklearn.decomposition import PCA
+from sklearn.utils.extmath import randomized_svd, svd_flip
 import pandas as pd
 import plotly.express as px
 import numpy as np
+from .profiling import profile
+from .dataset import cache_data, cache_resource
 
 
-@st.cache_data
-def get_pca_df(scaled, n=5):
-    # calculating Principal components
-    pca = PCA(n_components=n)
+# above this number of possible components only the requested ones are computed (randomized SVD)
+MAX_FULL_PCA = 1000
+
+
+@profile
+@cache_data
+def get_pca_decomposition(dataset, n_components=None, float32=False):
+    """Principal component scores and explained variance ratios, all components or the first n_components.
+
+    Wide tables (more features than samples) use the eigendecomposition of the samples x samples
+    Gram matrix, which is one matrix product instead of a full SVD. With n_components the
+    randomized SVD from scikit-learn is used. Signs follow sklearn's PCA.
+    """
+    X = dataset.X.astype(np.float32 if float32 else np.float64)
+    X -= X.mean(axis=0)
+    total_variance = (X**2).sum() / (X.shape[0] - 1)
+    if n_components is not None:
+        U, s, Vt = randomized_svd(X, n_components, random_state=0)
+    elif X.shape[1] > X.shape[0]:
+        eigenvalues, U = np.linalg.eigh(X @ X.T)
+        eigenvalues, U = eigenvalues[::-1], U[:, ::-1]
+        s = np.sqrt(np.clip(eigenvalues, 0, None))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            Vt = np.nan_to_num((U.T @ X) / s[:, None])
+    else:
+        U, s, Vt = np.linalg.svd(X, full_matrices=False)
+    U, Vt = svd_flip(U, Vt, u_based_decision=False)
+    return U * s, s**2 / (X.shape[0] - 1) / total_variance
+
+
+@profile
+def get_pca_df(dataset, n=5, float32=False):
+    # the decomposition is computed once and sliced for the requested number of components
+    n_max = min(dataset.X.shape)
+    if n_max <= MAX_FULL_PCA:
+        n_components = None
+    else:
+        # compute a block of components, more only if more are requested
+        n_components = min(n_max, max(50, 2 ** int(np.ceil(np.log2(n)))))
+    scores, explained_variance_ratio = get_pca_decomposition(dataset, n_components, float32)
     pca_df = pd.DataFrame(
-        data=pca.fit_transform(scaled), 
-        columns=[f"PC{x}" for x in range(1, n + 1)]
+        data=scores[:, :n],
+        columns=[f"PC{x}" for x in range(1, n + 1)],
+        index=dataset.samples,
     )
-    pca_df.index = scaled.index
-    return pca.explained_variance_ratio_, pca_df
+    return explained_variance_ratio[:n], pca_df
 
 
-@st.cache_resource
-def get_pca_scatter_plot(pca_df, pca_variance, attribute, md):
+@profile
+@cache_resource
+def get_pca_scatter_plot(dataset, pca_df, pca_variance, attribute):
     title = f"PRINCIPAL COMPONENT ANALYSIS"
 
     df = pd.merge(
         pca_df[["PC1", "PC2"]],
-        md[attribute].apply(str),
+        dataset.md[attribute].apply(str),
         left_index=True,
         right_index=True,
     )
@@ -47,7 +85,8 @@ def get_pca_scatter_plot(pca_df, pca_variance, attribute, md):
     return fig
 
 
-@st.cache_resource
+@profile
+@cache_resource
 def get_pca_scree_plot(pca_df, pca_variance):
     # To get a scree plot showing the variance of each PC in percentage:
     percent_variance = np.round(pca_variance * 100, decimals=2)
@@ -1,30 +1,129 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import os
+from concurrent.futures import ThreadPoolExecutor
 import skbio
+import scipy.stats as stats
 from scipy.spatial import distance
+from .distances import get_distance_matrix
+from .groupstats import encode_groups
+from .profiling import profile
+from .dataset import cache_data
 
-@st.cache_data
-def permanova_pcoa(scaled, distance_matrix, attribute):
-    # Create the distance matrix from the original data
+# permutations drawn at once, early stopping is checked after each chunk
+PERMUTATION_CHUNK = 200
+
+@profile
+@cache_data
+def get_pcoa(dataset, metric):
+    # PCoA only depends on the data and the distance metric, not on the attribute
     distance_matrix = skbio.stats.distance.DistanceMatrix(
-        distance.squareform(distance.pdist(scaled.values, distance_matrix))
+        distance.squareform(get_distance_matrix(dataset, metric))
     )
-    # perform PERMANOVA test
-    permanova = skbio.stats.distance.permanova(distance_matrix, attribute)
-    permanova["R2"] = 1 - 1 / (
-        1
-        + permanova["test statistic"]
-        * permanova["number of groups"]
-        / (permanova["sample size"] - permanova["number of groups"] - 1)
+    return skbio.stats.ordination.pcoa(distance_matrix)
+
+
+def get_within_group_ss(D2, codes, group_sizes):
+    """Within group sums of squares for a batch of group assignments (permutations x samples).
+
+    Each permutation and group is a column of a one-hot matrix G, the sums of squared distances
+    within the groups are the diagonal of G.T @ D2 @ G, one matrix product for the whole batch.
+    """
+    n_permutations, n = codes.shape
+    k = len(group_sizes)
+    one_hot = np.zeros((n, n_permutations * k))
+    one_hot[np.arange(n)[None, :], np.arange(n_permutations)[:, None] * k + codes] = 1
+    within = (one_hot * (D2 @ one_hot)).sum(axis=0).reshape(n_permutations, k)
+    return (within / group_sizes).sum(axis=1) / 2
+
+
+def permanova(distances, labels, permutations=999, seed=None, n_jobs=None, early_stopping=False, alpha=0.05):
+    """PERMANOVA on a square distance matrix, same results as skbio.stats.distance.permanova plus R2.
+
+    Permutations are evaluated in batches as matrix products on the squared distances, batches
+    run in n_jobs parallel threads (numpy releases the GIL). With early_stopping, permuting stops
+    after the first chunk of PERMUTATION_CHUNK permutations for which the 99.9% Clopper-Pearson
+    interval of the p-value lies entirely above or below alpha.
+    Samples with missing labels are left out.
+    """
+    codes, groups = encode_groups(labels)
+    valid = codes >= 0
+    D2 = np.asarray(distances, dtype=np.float64)[np.ix_(valid, valid)] ** 2
+    codes = codes[valid]
+    n, k = len(codes), len(groups)
+    if k < 2 or k == n:
+        raise ValueError("PERMANOVA needs at least two groups and at least one group with more than one sample.")
+    group_sizes = np.bincount(codes, minlength=k)
+    ss_total = D2.sum() / (2 * n)
+
+    def pseudo_f(codes):
+        ss_within = get_within_group_ss(D2, codes, group_sizes)
+        return ((ss_total - ss_within) / (k - 1)) / (ss_within / (n - k))
+
+    f = pseudo_f(codes[None, :])[0]
+    ss_within = get_within_group_ss(D2, codes[None, :], group_sizes)[0]
+
+    # permutations per batch, keeping the one-hot matrices at a few MB
+    batch_size = int(np.clip(2**20 // (n * k), 1, 100))
+    n_jobs = n_jobs or 1
+    rng = np.random.default_rng(seed)
+    n_better, n_done = 0, 0
+    with ThreadPoolExecutor(n_jobs) as executor:
+        while n_done < permutations:
+            # permutations are drawn and early stopping is checked per chunk of fixed size,
+            # the result does not depend on the number of threads
+            chunk = rng.permuted(np.tile(codes, (min(PERMUTATION_CHUNK, permutations - n_done), 1)), axis=1)
+            size = min(batch_size, -(-len(chunk) // n_jobs))
+            batches = [chunk[i : i + size] for i in range(0, len(chunk), size)]
+            n_better += sum((f_permuted >= f).sum() for f_permuted in executor.map(pseudo_f, batches))
+            n_done += len(chunk)
+            if early_stopping and n_done < permutations:
+                lower = stats.beta.ppf(0.0005, n_better, n_done - n_better + 1) if n_better else 0
+                upper = stats.beta.ppf(0.9995, n_better + 1, n_done - n_better) if n_better < n_done else 1
+                if lower > alpha or upper < alpha:
+                    break
+
+    return pd.Series(
+        {
+            "method name": "PERMANOVA",
+            "test statistic name": "pseudo-F",
+            "sample size": n,
+            "number of groups": k,
+            "test statistic": f,
+            "p-value": (n_better + 1) / (n_done + 1) if n_done else np.nan,
+            "number of permutations": n_done,
+            "R2": 1 - ss_within / ss_total,
+        },
+        name="PERMANOVA results",
+        dtype=object,
+    )
+
+
+@profile
+@cache_data
+def get_permanova(dataset, metric, attribute, permutations=999, seed=None, early_stopping=False):
+    return permanova(
+        distance.squareform(get_distance_matrix(dataset, metric)),
+        dataset.md[attribute],
+        permutations=permutations,
+        seed=seed,
+        n_jobs=min(4, os.cpu_count()),
+        early_stopping=early_stopping,
+    )
+
+
+@profile
+def permanova_pcoa(dataset, distance_matrix, attribute, permutations=999, seed=None, early_stopping=False):
+    # distances and PCoA are cached per metric, changing the attribute only reruns PERMANOVA
+    return (
+        get_permanova(dataset, distance_matrix, attribute, permutations, seed, early_stopping),
+        get_pcoa(dataset, distance_matrix),
     )
-    # perfom PCoA
-    pcoa = skbio.stats.ordination.pcoa(distance_matrix)
-    return permanova, pcoa
 
 
 # can not hash pcoa
+@profile
 def get_pcoa_scatter_plot(pcoa, md_samples, attribute):
     df = pcoa.samples[["PC1", "PC2"]]
     df = df.set_index(md_samples.index)
@@ -57,6 +156,7 @@ def get_pcoa_scatter_plot(pcoa, md_samples, attribute):
 
 
 # can not hash pcoa
+@profile
 def get_pcoa_variance_plot(pcoa):
     # To get a scree plot showing the variance of each PC in percentage:
     percent_variance = np.round(pcoa.proportion_explained * 100, decimals=2)
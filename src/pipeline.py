@@ -0,0 +1,314 @@
+"""Headless pipeline: data preparation, cleanup and statistical tests without the Streamlit app.
+
+Runs the same functions as the pages on a feature table + meta data pair (or GNPS task) and
+writes all result tables as Parquet or TSV files. Many datasets are processed in parallel.
+
+    python -m src.pipeline --ft FeatureMatrix.csv --md MetaData.txt --attribute Sample_Type --out results
+    python -m src.pipeline --datasets datasets.tsv --attribute Sample_Type --out results --workers 8
+
+The datasets table has a "name" column and either "feature_table" and "metadata" (file paths)
+or "task_id" (GNPS task) columns, the options apply to every dataset.
+"""
+import argparse
+import itertools
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import streamlit as st
+
+from .common import open_df, corrections_map
+from .fileselection import open_ft, get_new_index, load_from_gnps
+from .cleanup import prepare_data, imputation_methods
+from .anova import anova, tukey
+from .kruskal import kruskal_wallis, dunn
+from .ttest import gen_ttest_data
+from .pcoa import permanova_pcoa
+from .pca import get_pca_df
+from .randomforest import run_random_forest
+from .dataset import AnalysisDataset
+
+available_tests = ("anova", "tukey", "kruskal", "dunn", "ttest", "permanova", "pca", "randomforest")
+
+normalization_methods = {
+    "none": "None",
+    "center-scaling": "Center-Scaling",
+    "tic": "Total Ion Current (TIC) or sample-centric normalization",
+}
+
+
+def load_dataset(ft_file=None, md_file=None, task_id=None):
+    """Feature table (features x samples) and meta data, like the File Selection page."""
+    if task_id:
+        return load_from_gnps(task_id)
+    ft = open_ft(ft_file)
+    if ft is None:
+        ft = open_df(ft_file)
+        if "metabolite" in ft.columns:
+            ft.index = ft["metabolite"]
+        else:
+            ft, _ = get_new_index(ft)
+    ft = ft.dropna(axis=1)
+    md = open_df(md_file)
+    if ft.empty:
+        raise ValueError(f"Could not read quantification table {ft_file}.")
+    if "filename" not in md.columns:
+        raise ValueError(f"No 'filename' column in meta data table {md_file}.")
+    return ft, md.set_index("filename")
+
+
+def match_groups(groups, labels):
+    """Map group names given as text (command line) onto the labels of an attribute, e.g. "5" onto 5."""
+    labels = {str(label): label for label in labels}
+    missing = [group for group in groups if str(group) not in labels]
+    if missing:
+        raise ValueError(f"group(s) {', '.join(map(str, missing))} not found, valid groups: {', '.join(labels)}")
+    return [labels[str(group)] for group in groups]
+
+
+@contextmanager
+def catch_errors(errors, test):
+    # record the error of a test instead of raising it
+    try:
+        yield
+    except Exception as e:
+        errors[test] = f"{type(e).__name__}: {e}"
+
+
+def run_tests(
+    data,
+    md,
+    attribute,
+    tests=available_tests,
+    correction="fdr_bh",
+    groups=None,
+    paired=False,
+    alternative="two-sided",
+    welch="auto",
+    metric="braycurtis",
+    n_components=5,
+    permutations=999,
+    n_trees=100,
+    seed=123,
+):
+    """Run the selected tests for one attribute, returns a dict of result tables and a dict of errors.
+
+    Pairwise tests (Tukey's, Dunn's, t-test) run for the two given groups or for all pairs.
+    A failing test is recorded in the errors (test name: message), the other tests still run.
+    """
+    dataset = AnalysisDataset(data, md)
+    if groups:
+        pairs = [tuple(match_groups(groups, dataset.groups[attribute]))]
+    else:
+        pairs = list(itertools.combinations(dataset.groups[attribute].tolist(), 2))
+
+    results, errors = {}, {}
+    if "anova" in tests or "tukey" in tests:
+        with catch_errors(errors, "anova"):
+            results["anova"] = anova(dataset, attribute, correction)
+        if "tukey" in tests and "anova" in results and results["anova"]["significant"].any():
+            with catch_errors(errors, "tukey"):
+                results["tukey"] = pd.concat(
+                    [tukey(dataset, results["anova"], attribute, list(pair), correction) for pair in pairs],
+                    ignore_index=True,
+                )
+
+    if "kruskal" in tests or "dunn" in tests:
+        with catch_errors(errors, "kruskal"):
+            results["kruskal"] = kruskal_wallis(dataset, attribute, correction)
+        if "dunn" in tests and "kruskal" in results and results["kruskal"]["significant"].any():
+            with catch_errors(errors, "dunn"):
+                results["dunn"] = pd.concat(
+                    [dunn(dataset, results["kruskal"], attribute, list(pair), correction) for pair in pairs],
+                    ignore_index=True,
+                )
+
+    if "ttest" in tests:
+        with catch_errors(errors, "ttest"):
+            results["ttest"] = pd.concat(
+                [gen_ttest_data(dataset, attribute, list(pair), paired, alternative, welch, correction) for pair in pairs]
+            )
+
+    if "permanova" in tests:
+        with catch_errors(errors, "permanova"):
+            permanova, pcoa = permanova_pcoa(dataset, metric, attribute, permutations, seed)
+            results["permanova"] = permanova.astype(str).to_frame("value")
+            results["pcoa"] = pcoa.samples.set_index(data.index)
+            results["pcoa_variance"] = pcoa.proportion_explained.to_frame("explained variance")
+
+    if "pca" in tests:
+        with catch_errors(errors, "pca"):
+            pca_variance, pca_df = get_pca_df(dataset, min(n_components, *data.shape))
+            results["pca"] = pca_df
+            results["pca_variance"] = pd.DataFrame(
+                {"explained variance": pca_variance}, index=pca_df.columns
+            )
+
+    if "randomforest" in tests:
+        with catch_errors(errors, "randomforest"):
+            df_oob, df_important_features = run_random_forest(dataset, attribute, n_trees, seed)[:2]
+            results["randomforest_importance"] = df_important_features
+            results["randomforest_oob"] = df_oob
+
+    return results, errors
+
+
+def write_results(results, out_dir, fmt="parquet"):
+    """Write every result table to out_dir as Parquet or TSV, returns the file paths."""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = []
+    for name, df in results.items():
+        if fmt == "parquet":
+            path = out_dir / f"{name}.parquet"
+            df.to_parquet(path)
+        else:
+            path = out_dir / f"{name}.tsv"
+            df.to_csv(path, sep="\t")
+        paths.append(path)
+    return paths
+
+
+def run_dataset(dataset, out_dir, fmt="parquet", prepare_options=None, test_options=None):
+    """Load, prepare and test one dataset (dict with name and files or task_id).
+
+    Returns the dataset name and an error message (None on success), so that a failing
+    dataset does not stop a batch. The tables of the tests that succeeded are written
+    also when other tests failed, the message names the failed tests.
+    """
+    name = dataset["name"]
+    try:
+        ft, md = load_dataset(dataset.get("feature_table"), dataset.get("metadata"), dataset.get("task_id"))
+        md, data = prepare_data(ft, md, **(prepare_options or {}))
+        results = {"metadata": md.astype(str), "data": data}
+        test_results, errors = run_tests(data, md, **(test_options or {}))
+        results.update(test_results)
+        write_results(results, Path(out_dir, name), fmt)
+        error = "; ".join(f"{test} failed ({message})" for test, message in errors.items()) or None
+    except Exception as e:
+        error = f"failed ({type(e).__name__}: {e})"
+    # cached results are not needed for the next dataset
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    return name, error
+
+
+def run_batch(datasets, out_dir, workers=None, **kwargs):
+    """Process datasets in parallel with a pool of worker processes, yields (name, error)."""
+    if workers == 1:
+        for dataset in datasets:
+            yield run_dataset(dataset, out_dir, **kwargs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_dataset, dataset, out_dir, **kwargs) for dataset in datasets]
+        for future in futures:
+            yield future.result()
+
+
+def read_datasets(path):
+    datasets = open_df(path)
+    if "name" not in datasets.columns:
+        raise ValueError(f"No 'name' column in datasets table {path}.")
+    return [
+        {key: value for key, value in row.items() if pd.notna(value)}
+        for row in datasets.astype(object).to_dict("records")
+    ]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    data = parser.add_argument_group("data")
+    data.add_argument("--ft", help="quantification table")
+    data.add_argument("--md", help="meta data table")
+    data.add_argument("--task-id", help="GNPS task ID instead of --ft and --md")
+    data.add_argument("--name", default="dataset", help="output sub directory for a single dataset")
+    data.add_argument("--datasets", help="table with many datasets (name, feature_table, metadata or task_id)")
+    data.add_argument("--out", default="results", help="output directory")
+    data.add_argument("--format", choices=["parquet", "tsv"], default="parquet")
+    data.add_argument("--workers", type=int, default=None, help="number of processes (default: all cores)")
+
+    prep = parser.add_argument_group("data preparation")
+    prep.add_argument("--sample-attribute", help="attribute for sample selection (blank removal)")
+    prep.add_argument("--samples", nargs="+", help="sample groups (blank removal)")
+    prep.add_argument("--blank-attribute", help="attribute for blank selection (blank removal)")
+    prep.add_argument("--blanks", nargs="+", help="blank groups, enables blank removal")
+    prep.add_argument("--blank-cutoff", type=float, default=0.3)
+    prep.add_argument("--imputation", choices=list(imputation_methods.values()))
+    prep.add_argument("--seed", type=int, default=123, help="random seed for imputation, PERMANOVA and random forest")
+    prep.add_argument("--neighbors", type=int, default=5, help="number of neighbours for KNN imputation")
+    prep.add_argument("--normalization", choices=list(normalization_methods.keys()), default="none")
+
+    tests = parser.add_argument_group("statistics")
+    tests.add_argument("--attribute", required=True, help="meta data attribute for the tests")
+    tests.add_argument("--tests", nargs="+", choices=available_tests, default=list(available_tests[:-1]))
+    tests.add_argument("--groups", nargs=2, help="two groups for pairwise tests (default: all pairs)")
+    tests.add_argument("--correction", choices=list(corrections_map.values()), default="fdr_bh")
+    tests.add_argument("--paired", action="store_true", help="paired t-test")
+    tests.add_argument("--alternative", choices=["two-sided", "greater", "less"], default="two-sided")
+    tests.add_argument("--welch", choices=["auto", "True", "False"], default="auto")
+    tests.add_argument("--metric", default="braycurtis", help="distance metric for PERMANOVA & PCoA")
+    tests.add_argument("--permutations", type=int, default=999, help="number of PERMANOVA permutations")
+    tests.add_argument("--components", type=int, default=5, help="number of PCA components")
+    tests.add_argument("--trees", type=int, default=100, help="number of random forest trees")
+    args = parser.parse_args(args)
+
+    if args.datasets:
+        datasets = read_datasets(args.datasets)
+    elif args.task_id or (args.ft and args.md):
+        datasets = [{"name": args.name, "feature_table": args.ft, "metadata": args.md, "task_id": args.task_id}]
+    else:
+        parser.error("either --datasets, --task-id or --ft and --md are required")
+    if args.blanks and not (args.samples and args.sample_attribute and args.blank_attribute):
+        parser.error("blank removal needs --sample-attribute, --samples and --blank-attribute")
+    if args.groups:
+        # check the groups in the meta data files before processing (GNPS tasks are checked in run_tests)
+        for dataset in datasets:
+            if dataset.get("metadata"):
+                md = open_df(dataset["metadata"])
+                if args.attribute in md.columns:
+                    try:
+                        match_groups(args.groups, md[args.attribute].dropna().unique())
+                    except ValueError as e:
+                        parser.error(f"{dataset['name']}: {e}")
+
+    prepare_options = {
+        "sample_attribute": args.sample_attribute,
+        "samples": args.samples,
+        "blank_attribute": args.blank_attribute,
+        "blanks": args.blanks,
+        "blank_cutoff": args.blank_cutoff,
+        "imputation": args.imputation,
+        "seed": args.seed,
+        "n_neighbors": args.neighbors,
+        "normalization_method": normalization_methods[args.normalization],
+    }
+    test_options = {
+        "attribute": args.attribute,
+        "tests": args.tests,
+        "correction": args.correction,
+        "groups": args.groups,
+        "paired": args.paired,
+        "alternative": args.alternative,
+        "welch": args.welch,
+        "metric": args.metric,
+        "n_components": args.components,
+        "permutations": args.permutations,
+        "n_trees": args.trees,
+        "seed": args.seed,
+    }
+
+    n_failed = 0
+    for name, error in run_batch(
+        datasets, args.out, args.workers, fmt=args.format, prepare_options=prepare_options, test_options=test_options
+    ):
+        if error:
+            n_failed += 1
+            print(f"{name}: {error}")
+        else:
+            print(f"{name}: done")
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,164 @@
+import functools
+import json
+import threading
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit as st
+from streamlit import runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# opt-in with the "profile reruns" checkbox in the sidebar, records are kept per rerun in st.session_state.profile
+_local = threading.local()
+# tracemalloc is process-wide, it runs while at least one session profiles
+_tracing_sessions = set()
+_tracing_lock = threading.Lock()
+
+
+def is_enabled():
+    # only in the script thread of the app, not in batch processing or worker threads
+    return get_script_run_ctx() is not None and st.session_state.get("profiling", False)
+
+
+def set_tracing(enabled):
+    """Start or stop memory tracing for the current session.
+
+    Sessions that disconnected while profiling are dropped, tracing stops when no active session profiles.
+    """
+    session_id = get_script_run_ctx().session_id
+    with _tracing_lock:
+        if runtime.exists():
+            active = runtime.get_instance().is_active_session
+            _tracing_sessions.intersection_update([s for s in _tracing_sessions if active(s)])
+        if enabled:
+            _tracing_sessions.add(session_id)
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+        else:
+            _tracing_sessions.discard(session_id)
+            if not _tracing_sessions and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+
+def _stack():
+    if not hasattr(_local, "stack"):
+        _local.stack = []
+    return _local.stack
+
+
+class Profile:
+    """Context manager recording wall time, CPU time and peak allocation of a block."""
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = False
+
+    def __enter__(self):
+        self.enabled = is_enabled()
+        if not self.enabled:
+            return self
+        if not tracemalloc.is_tracing():
+            set_tracing(True)
+        stack = _stack()
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # the peak is reset for this block, keep the one of the enclosing block so far
+            stack[-1].max_peak = max(stack[-1].max_peak, peak)
+        tracemalloc.reset_peak()
+        self.start_memory, self.max_peak, self.cache = current, 0, None
+        self.depth = len(stack)
+        stack.append(self)
+        self.start_cpu, self.start_wall = time.process_time(), time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if not self.enabled:
+            return False
+        wall, cpu = time.perf_counter() - self.start_wall, time.process_time() - self.start_cpu
+        peak = max(tracemalloc.get_traced_memory()[1], self.max_peak)
+        stack = _stack()
+        stack.pop()
+        if stack:
+            stack[-1].max_peak = max(stack[-1].max_peak, peak)
+        records = st.session_state.setdefault("profile", [])
+        records.append(
+            {
+                "name": self.name,
+                "depth": self.depth,
+                "wall time (s)": round(wall, 4),
+                "cpu time (s)": round(cpu, 4),
+                "peak allocation (MiB)": round((peak - self.start_memory) / 1024**2, 3),
+                "cache": self.cache,
+            }
+        )
+        if not stack:
+            show_profile()
+        return False
+
+
+def set_cache_status(status):
+    # of the innermost profiled call, e.g. "disk" for results read from the result store
+    stack = _stack()
+    if stack:
+        stack[-1].cache = status
+
+
+def profile(func_or_name):
+    """Record calls of a function (decorator) or a block of code (context manager with a name).
+
+    For functions cached with cache_data or cache_resource (src/dataset.py) apply it above the cache
+    decorator, calls are then recorded as cache hit or miss ("disk" for results read from the result store).
+    """
+    if not callable(func_or_name):
+        return Profile(func_or_name)
+    func = func_or_name
+    name = f"{func.__module__.split('.')[-1]}.{func.__name__}"
+    # cached functions have a clear method, a miss is marked when the function itself runs
+    cached = hasattr(func, "clear")
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not is_enabled():
+            return func(*args, **kwargs)
+        with Profile(name) as p:
+            if cached:
+                p.cache = "hit"
+            return func(*args, **kwargs)
+
+    if cached:
+        wrapper.clear = func.clear
+    return wrapper
+
+
+def profile_expander():
+    # sidebar expander with the profile of the current rerun, filled while the page runs
+    st.session_state["profile"] = []
+    with st.expander("⏱️ Profiling"):
+        st.checkbox(
+            "profile reruns",
+            False,
+            key="profiling",
+            help="Record wall time, CPU time, peak memory allocation and cache hits of the analysis functions for every rerun. Memory figures are process-wide, they include allocations of other sessions running at the same time. Memory tracing slows down the app for all sessions.",
+        )
+        st.session_state["profile_placeholder"] = st.empty()
+    set_tracing(st.session_state.profiling)
+
+
+def show_profile():
+    records = st.session_state.get("profile", [])
+    placeholder = st.session_state.get("profile_placeholder")
+    if placeholder is None or not records:
+        return
+    with placeholder.container():
+        df = pd.DataFrame(records)
+        df["name"] = ["  " * depth + name for depth, name in zip(df["depth"], df["name"])]
+        st.dataframe(df.drop(columns="depth"), hide_index=True)
+        # the placeholder is redrawn after every call, each download button needs its own key
+        st.download_button(
+            "Download JSON",
+            json.dumps(records, indent=2),
+            "profile.json",
+            "application/json",
+            key=f"profile_download_{len(records)}",
+        )
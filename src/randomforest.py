@@ -1,15 +1,79 @@
-import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
-from sklearn.preprocessing import OrdinalEncoder
-from sklearn.model_selection import train_test_split, StratifiedKFold, cross_val_score
+import scipy.stats as stats
+from sklearn.model_selection import train_test_split, StratifiedKFold
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.utils import class_weight
 from sklearn.metrics import classification_report
 from sklearn.metrics import confusion_matrix, accuracy_score
+from joblib import Parallel, delayed
+from .profiling import profile
+from .dataset import cache_data, store_results
 
-def run_random_forest(attribute, n_trees, random_seed=None):
+def get_oob_errors(rf, features, labels, tree_range):
+    """Out-of-bag error rate of the first n trees of a fitted forest, for every n in tree_range.
+
+    OOB class probabilities are summed up tree by tree, as RandomForestClassifier does for
+    oob_score_, so the curve needs one forest instead of refitting for every number of trees.
+    """
+    X = np.asarray(features, dtype=np.float32)
+    y = np.searchsorted(rf.classes_, labels)
+    oob_proba = np.zeros((X.shape[0], len(rf.classes_)))
+    tree_range = set(tree_range)
+    errors = []
+    for n, (tree, in_bag) in enumerate(zip(rf.estimators_, rf.estimators_samples_), start=1):
+        oob = np.ones(X.shape[0], dtype=bool)
+        oob[in_bag] = False
+        # with few training samples a bootstrap sample can contain all of them
+        if oob.any():
+            oob_proba[oob] += tree.predict_proba(X[oob])
+        if n in tree_range:
+            # samples without OOB prediction yet count as first class, like in sklearn
+            errors.append(1 - np.mean(oob_proba.argmax(axis=1) == y))
+    return errors
+
+
+def permutation_scores(rf, features, labels, columns, n_repeats, seeds):
+    """Accuracy with each of the columns permuted, all repeats of a column are predicted in one batch."""
+    n = features.shape[0]
+    X = np.tile(features, (n_repeats, 1))
+    y = np.tile(labels, n_repeats)
+    scores = np.empty((len(columns), n_repeats))
+    for i, (col, seed) in enumerate(zip(columns, seeds)):
+        rng = np.random.default_rng(seed)
+        X[:, col] = np.concatenate([rng.permutation(features[:, col]) for _ in range(n_repeats)])
+        scores[i] = (rf.predict(X) == y).reshape(n_repeats, n).mean(axis=1)
+        X[:, col] = np.tile(features[:, col], n_repeats)
+    return scores
+
+
+def get_permutation_importance(rf, features, labels, columns, n_repeats=10, random_seed=None, n_jobs=None):
+    """Decrease in accuracy when a feature column is permuted, with 95% confidence interval over the repeats.
+
+    The columns are split into batches which are evaluated in parallel worker processes, each column has its
+    own seed so the result does not depend on the number of batches.
+    """
+    baseline = accuracy_score(labels, rf.predict(features))
+    batches = [b for b in np.array_split(np.arange(len(columns)), n_jobs or 1) if len(b)]
+    columns = np.asarray(columns)
+    seeds = np.random.SeedSequence(random_seed).spawn(len(columns))
+    scores = np.concatenate(
+        Parallel(n_jobs=len(batches))(
+            delayed(permutation_scores)(rf, features, labels, columns[batch], n_repeats, [seeds[i] for i in batch])
+            for batch in batches
+        )
+    )
+    importances = baseline - scores
+    mean = importances.mean(axis=1)
+    ci = stats.t.ppf(0.975, n_repeats - 1) * importances.std(axis=1, ddof=1) / np.sqrt(n_repeats)
+    return pd.DataFrame({"permutation importance": mean, "ci lower": mean - ci, "ci upper": mean + ci})
+
+
+@profile
+@cache_data
+@store_results
+def run_random_forest(dataset, attribute, n_trees, random_seed=None, _n_jobs=None, top_k=0, n_repeats=10, _store=True):
     # initialize a log to print out in the app later
     log = ""
 
@@ -20,19 +84,9 @@ def run_random_forest(attribute, n_trees, random_seed=None):
     class_report = "Classification report here"
     label_mapping = "Label mapping here"
 
-    labels = st.session_state.md[[attribute]]
-    rf_data = pd.concat([st.session_state.data, labels], axis=1)
-
-    # Change the values of the attribute of interest from strings to a numerical
-    enc = OrdinalEncoder()
-    # st.write(labels.value_counts()) # Displays the sample size for each group
-    labels = enc.fit_transform(labels)
-    labels = np.array([x[0] + 1 for x in labels])
-
-    class_names = enc.categories_[0] #getting the class names
-
-    # Extract the feature intensities as np 2D array
-    features = np.array(st.session_state.data)
+    # feature intensities and the values of the attribute of interest as numbers (1, 2, ...)
+    features, codes, class_names = dataset.get_labelled(attribute)
+    labels = codes + 1.0
 
     # Determine the smallest class size and adjust test_size accordingly
     unique, counts = np.unique(labels, return_counts=True)
@@ -62,7 +116,7 @@ def run_random_forest(attribute, n_trees, random_seed=None):
         weights[w] = sklearn_weights[i]
 
     # Set up the random forest classifier with 100 tress, balanded weights, and a random state to make it reproducible
-    rf = RandomForestClassifier(n_estimators=n_trees, class_weight= weights, random_state=random_seed)
+    rf = RandomForestClassifier(n_estimators=n_trees, class_weight= weights, random_state=random_seed, n_jobs=_n_jobs)
    
     # Fit the classifier to the training set
     rf.fit(train_features, train_labels)
@@ -75,8 +129,8 @@ def run_random_forest(attribute, n_trees, random_seed=None):
     log += f"Classifier mean accuracy score: {classifier_accuracy}%.\n"
 
     # Calculate confusion matrices
-    test_confusion_matrix = confusion_matrix(test_labels, predictions_test, labels=range(len(class_names)))
-    train_confusion_matrix = confusion_matrix(train_labels, predictions_train, labels=range(len(class_names)))
+    test_confusion_matrix = confusion_matrix(test_labels, predictions_test, labels=np.arange(1, len(class_names) + 1))
+    train_confusion_matrix = confusion_matrix(train_labels, predictions_train, labels=np.arange(1, len(class_names) + 1))
 
     test_confusion_df = pd.DataFrame(test_confusion_matrix, index=class_names, columns=class_names)
     train_confusion_df = pd.DataFrame(train_confusion_matrix, index=class_names, columns=class_names)
@@ -88,29 +142,101 @@ def run_random_forest(attribute, n_trees, random_seed=None):
     class_report = classification_report(test_labels, predictions_test)
 
     # Print the sample areas corresponding to the numbers in the report
-    label_mapping = "\n".join([f"{i+1.0} ,{cat}" for i, cat in enumerate(enc.categories_[0])])
+    label_mapping = "\n".join([f"{i+1.0} ,{cat}" for i, cat in enumerate(class_names)])
 
     # Most important model quality plot
     # OOB error lines should flatline. If it doesn't flatline add more trees
-    rf_oob = RandomForestClassifier(class_weight=weights, warm_start=True, oob_score=True, random_state=123)
-    errors = []
+    # one forest with the largest number of trees, the errors for fewer trees come from its first trees
     tree_range = np.arange(1,500, 10)
-    for i in tree_range:
-        rf_oob.set_params(n_estimators=i)
-        rf_oob.fit(train_features, train_labels)
-        errors.append(1-rf_oob.oob_score_)
-
+    rf_oob = RandomForestClassifier(n_estimators=tree_range[-1], class_weight=weights, random_state=123, n_jobs=_n_jobs)
+    rf_oob.fit(train_features, train_labels)
+    errors = get_oob_errors(rf_oob, train_features, train_labels, tree_range)
 
     df_oob = pd.DataFrame({"n trees": tree_range, "error rate": errors})
 
     # Extract the important features in the model
     df_important_features = pd.DataFrame(rf.feature_importances_, 
-                                         index=st.session_state.data.columns).sort_values(by=0, ascending=False)
+                                         index=dataset.features).sort_values(by=0, ascending=False)
     df_important_features.columns = ["importance"]
-    
+
+    # permutation importance on the test set, limited to the top features by impurity importance
+    if top_k:
+        top = df_important_features.index[:top_k]
+        rf.set_params(n_jobs=1)
+        df_permutation = get_permutation_importance(
+            rf, test_features, test_labels, dataset.get_columns(top), n_repeats, random_seed, _n_jobs
+        )
+        df_important_features = df_important_features.join(df_permutation.set_axis(top))
+        log += f"Permutation importance of the top {len(top)} features with {n_repeats} repeats on the test set.\n"
+
     return df_oob, df_important_features, log, class_report, label_mapping, test_confusion_df, train_confusion_df, test_accuracy, train_accuracy
 
 
+def get_balanced_weights(labels):
+    classes = np.unique(labels)
+    return dict(zip(classes, class_weight.compute_class_weight(class_weight="balanced", classes=classes, y=labels)))
+
+
+def fit_fold(features, labels, train, test, n_trees, random_seed):
+    """Fit a random forest on the training samples of one fold, returns the test predictions and feature importances."""
+    rf = RandomForestClassifier(n_estimators=n_trees, class_weight=get_balanced_weights(labels[train]), random_state=random_seed)
+    rf.fit(features[train], labels[train])
+    return rf.predict(features[test]), rf.feature_importances_
+
+
+@profile
+@cache_data
+@store_results
+def run_random_forest_cv(dataset, attribute, n_trees, random_seed=None, n_folds=5, _n_jobs=None, _store=True):
+    """Stratified k-fold cross-validation, the folds are fitted in parallel worker processes.
+
+    Accuracy, confusion matrices and feature importances are mean and standard deviation over the folds,
+    the classification report is for the pooled out-of-fold predictions (each sample is predicted once).
+    """
+    log = ""
+
+    features, codes, class_names = dataset.get_labelled(attribute)
+    labels = codes + 1.0
+
+    # every fold needs at least one sample of each class
+    n_folds = min(n_folds, np.unique(labels, return_counts=True)[1].min())
+    if n_folds < 2:
+        raise ValueError("Cross-validation needs at least two samples in each class.")
+    folds = list(StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=random_seed).split(features, labels))
+
+    # each fold builds its trees in a single process, the folds run in parallel
+    results = Parallel(n_jobs=min(n_folds, _n_jobs or n_folds))(
+        delayed(fit_fold)(features, labels, train, test, n_trees, random_seed) for train, test in folds
+    )
+
+    predictions = np.empty_like(labels)
+    accuracies, confusion_matrices, importances = [], [], []
+    for (train, test), (predictions_test, feature_importances) in zip(folds, results):
+        predictions[test] = predictions_test
+        accuracies.append(accuracy_score(labels[test], predictions_test))
+        confusion_matrices.append(confusion_matrix(labels[test], predictions_test, labels=np.arange(1, len(class_names) + 1)))
+        importances.append(feature_importances)
+    accuracies, confusion_matrices, importances = np.array(accuracies), np.array(confusion_matrices), np.array(importances)
+
+    log += f"Stratified {n_folds}-fold cross-validation\n"
+    log += f"Features Shape: {features.shape}\n"
+    log += f"Labels Shape: {labels.shape}\n"
+    log += f"Fold accuracy scores: {', '.join(f'{a*100:.2f}%' for a in accuracies)}\n"
+    log += f"Classifier mean accuracy score: {accuracies.mean()*100:.2f}% ± {accuracies.std(ddof=1)*100:.2f}%.\n"
+
+    confusion_mean_df = pd.DataFrame(confusion_matrices.mean(axis=0), index=class_names, columns=class_names)
+    confusion_sd_df = pd.DataFrame(confusion_matrices.std(axis=0, ddof=1), index=class_names, columns=class_names)
+
+    class_report = classification_report(labels, predictions)
+    label_mapping = "\n".join([f"{i+1.0} ,{cat}" for i, cat in enumerate(class_names)])
+
+    df_important_features = pd.DataFrame(
+        {"importance": importances.mean(axis=0), "sd": importances.std(axis=0, ddof=1)}, index=dataset.features
+    ).sort_values(by="importance", ascending=False)
+
+    return df_important_features, log, class_report, label_mapping, confusion_mean_df, confusion_sd_df, accuracies.mean(), accuracies.std(ddof=1)
+
+
 def get_oob_fig(df):
     return px.line(df, x="n trees", y="error rate", title="out-of-bag (OOB) error")
 
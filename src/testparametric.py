@@ -1,30 +1,99 @@
-import streamlit as st
 import pandas as pd
+import numpy as np
 import plotly.express as px
 import scipy.stats as stats
 import pingouin as pg
+from .groupstats import group_sums
+from .dataset import cache_data
+from .profiling import profile
 
 
-@st.cache_data
-def test_equal_variance(attribute, between, correction):
+def get_levene_data(X, codes, groups, columns, center="median"):
+    """Levene test for equal variances for all feature columns at once.
+
+    center="median" is the Brown-Forsythe variant (the scipy.stats.levene default),
+    center="mean" the original Levene test.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    n, k = X.shape[0], len(groups)
+
+    if center == "median":
+        centers = np.array([np.median(X[codes == i], axis=0) for i in range(k)])
+    else:
+        centers = np.array([X[codes == i].mean(axis=0) for i in range(k)])
+    Z = np.abs(X - centers[codes])
+
+    n_group = np.bincount(codes, minlength=k).astype(np.float64)
+    Z_means = group_sums(Z, codes, k) / n_group[:, None]
+    numerator = (n - k) * (n_group[:, None] * (Z_means - Z.mean(axis=0)) ** 2).sum(axis=0)
+    denominator = (k - 1) * ((Z - Z_means[codes]) ** 2).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = numerator / denominator
+    p = stats.f.sf(w, k - 1, n - k)
+    return pd.DataFrame({"W": w, "p": p}, index=columns)
+
+
+def shapiro_coefficients(n):
+    """Shapiro-Wilk coefficients for sample size n (Royston 1995, algorithm AS R94)."""
+    if n == 3:
+        return np.array([-np.sqrt(0.5), 0, np.sqrt(0.5)])
+    m = stats.norm.ppf((np.arange(1, n + 1) - 3 / 8) / (n + 1 / 4))
+    summ2 = (m**2).sum()
+    u = 1 / np.sqrt(n)
+    a = np.empty(n)
+    a[-1] = m[-1] / np.sqrt(summ2) + np.polyval([-2.706056, 4.434685, -2.071190, -0.147981, 0.221157, 0], u)
+    if n > 5:
+        a[-2] = m[-2] / np.sqrt(summ2) + np.polyval([-3.582633, 5.682633, -1.752461, -0.293762, 0.042981, 0], u)
+        phi = (summ2 - 2 * m[-1] ** 2 - 2 * m[-2] ** 2) / (1 - 2 * a[-1] ** 2 - 2 * a[-2] ** 2)
+        a[2:-2] = m[2:-2] / np.sqrt(phi)
+        a[:2] = -a[:-3:-1]
+    else:
+        phi = (summ2 - 2 * m[-1] ** 2) / (1 - 2 * a[-1] ** 2)
+        a[1:-1] = m[1:-1] / np.sqrt(phi)
+        a[0] = -a[-1]
+    return a
+
+
+def get_shapiro_data(X, columns):
+    """Shapiro-Wilk test for normality for all feature columns of one group at once.
+
+    All features share the sample size, so the coefficients are computed once and W
+    is a single matrix product with the column-wise sorted data. p-values use
+    Royston's normal approximation, like scipy.stats.shapiro.
+    """
+    X = np.sort(np.asarray(X, dtype=np.float64), axis=0)
+    n = X.shape[0]
+    ss = ((X - X.mean(axis=0)) ** 2).sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.clip((shapiro_coefficients(n) @ X) ** 2 / ss, 0, 1)
+
+        if n == 3:
+            p = np.clip(6 / np.pi * (np.arcsin(np.sqrt(w)) - np.arcsin(np.sqrt(0.75))), 0, 1)
+        elif n <= 11:
+            gamma = -2.273 + 0.459 * n
+            mu = np.polyval([-0.0006714, 0.025054, -0.39978, 0.5440], n)
+            sigma = np.exp(np.polyval([-0.0020322, 0.062767, -0.77857, 1.3822], n))
+            y = np.log1p(-w)
+            p = np.where(y < gamma, stats.norm.sf((-np.log(gamma - y) - mu) / sigma), 1e-99)
+        else:
+            log_n = np.log(n)
+            mu = np.polyval([0.0038915, -0.083751, -0.31082, -1.5861], log_n)
+            sigma = np.exp(np.polyval([0.0030302, -0.082676, -0.4803], log_n))
+            p = stats.norm.sf((np.log1p(-w) - mu) / sigma)
+
+    # features without any variation are reported as perfectly normal, like scipy
+    w[ss == 0], p[ss == 0] = 1, 1
+    return pd.DataFrame({"W": w, "p": p}, index=columns)
+
+
+@profile
+@cache_data
+def test_equal_variance(dataset, attribute, between, correction):
     # test for equal variance
-    data = pd.concat([st.session_state.data, st.session_state.md], axis=1)
+    levene = get_levene_data(*dataset.select(attribute, sorted(between)), dataset.features)
     variance = pd.DataFrame(
-        {
-            f"{between[0]} - {between[1]}": pg.multicomp([
-                stats.levene(
-                    data.loc[
-                        (data[attribute] == between[0]),
-                        f,
-                    ],
-                    data.loc[
-                        (data[attribute] == between[1]),
-                        f,
-                    ],
-                )[1]
-                for f in st.session_state.data.columns
-            ], method=correction)[1]
-        }
+        {f"{between[0]} - {between[1]}": pg.multicomp(levene["p"].to_numpy(), method=correction)[1]},
+        index=levene.index,
     )
     fig = px.histogram(
         variance,
@@ -40,30 +109,22 @@ def test_equal_variance(attribute, between, correction):
         yaxis_title="count",
         showlegend=False
     )
-    return fig
+    return variance, fig
 
 
-@st.cache_data
-def test_normal_distribution(attribute, between, correction):
-    # test for normal distribution
-    data = pd.concat([st.session_state.data, st.session_state.md], axis=1)
+@profile
+@cache_data
+def test_normal_distribution(dataset, attribute, between, correction):
+    # test for normal distribution, needs at least 3 values in each option
     for b in between:
-        if st.session_state.md[attribute].value_counts().loc[b] < 3:
-            st.warning("You need at least 3 values in each option to test for normality!")
-            return None
+        if len(dataset.group_rows[attribute][b]) < 3:
+            return None, None
     normality = pd.DataFrame(
         {
-            f"{b}": pg.multicomp([
-                stats.shapiro(
-                    data.loc[
-                        (data[attribute] == b),
-                        f,
-                    ]
-                )[1]
-                for f in st.session_state.data.columns
-            ], method = correction)[1]
+            f"{b}": pg.multicomp(get_shapiro_data(dataset.X[dataset.group_rows[attribute][b]], dataset.features)["p"].to_numpy(), method=correction)[1]
             for b in between
-        }
+        },
+        index=dataset.features,
     )
 
     fig = px.histogram(
@@ -82,4 +143,4 @@ def test_normal_distribution(attribute, between, correction):
         yaxis_title="count",
         showlegend=True
     )
-    return fig
+    return normality, fig
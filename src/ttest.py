@@ -1,36 +1,165 @@
-import streamlit as st
 import pandas as pd
 import pingouin as pg
 import plotly.express as px
 import numpy as np
+import scipy.stats as stats
+from scipy.special import logsumexp
+from .profiling import profile
+from .dataset import cache_data, cache_resource, store_results
 
 
-@st.cache_data
-def gen_ttest_data(ttest_attribute, target_groups, paired, alternative, correction, p_correction):
-    df = pd.concat([st.session_state.data, st.session_state.md], axis=1)
-    ttest = []
-    for col in st.session_state.data.columns:
-        group1 = df[col][df[ttest_attribute] == target_groups[0]]
-        group2 = df[col][df[ttest_attribute] == target_groups[1]]
-        result = pg.ttest(group1, group2, paired, alternative, correction)
-        result["metabolite"] = col
+def format_bf(bf):
+    """Format BF10 values like pingouin (floating point or scientific notation)."""
+    if bf >= 1e4 or bf <= 1e-4:
+        return np.format_float_scientific(bf, precision=3, trim="0")
+    return np.format_float_positional(bf, precision=3, trim="0")
 
-        ttest.append(result)
 
-    ttest = pd.concat(ttest).set_index("metabolite")
-    ttest = ttest.dropna()
+def bayesfactor_ttest(t, n, df, alternative, r=0.707, chunk_size=1000):
+    """JZS Bayes factors (Rouder et al. 2009) for an array of T values.
+
+    The integral over g is evaluated in log-space on a fixed grid of log(g) for
+    chunks of features at once instead of one scipy quad call per feature.
+    """
+    u = np.linspace(-10, 50, 1024)[:, None]
+    g = np.exp(u)
+    # trapezoidal rule weights in log-space
+    log_w = np.full(u.shape, np.log(u[1, 0] - u[0, 0]))
+    log_w[[0, -1]] += np.log(0.5)
+    log_prior = -0.5 * np.log1p(n * g * r**2) - 0.5 * np.log(2 * np.pi) - 1.5 * u - 1 / (2 * g) + u + log_w
+
+    t = np.asarray(t, dtype=np.float64)
+    bf10 = np.full(t.shape, np.nan)
+    for start in range(0, t.size, chunk_size):
+        t_chunk = t[None, start : start + chunk_size]
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            log_f = log_prior - (df + 1) / 2 * np.log1p(t_chunk**2 / ((1 + n * g * r**2) * df))
+            bf10[start : start + chunk_size] = np.exp(
+                logsumexp(log_f, axis=0) + (df + 1) / 2 * np.log1p(t_chunk[0] ** 2 / df)
+            )
+    bf10[~np.isfinite(t)] = np.nan
+
+    if alternative != "two-sided":
+        bf10 = bf10 * 2
+        wrong_direction = (t < 0) if alternative == "greater" else (t > 0)
+        flip = wrong_direction & (bf10 > 1)
+        bf10[flip] = 1 / bf10[flip]
+    return bf10
+
+
+def get_ttest_data(x, y, columns, paired, alternative, correction, confidence=0.95):
+    """pg.ttest for all feature columns of two (samples x features) matrices at once."""
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    nx, ny = x.shape[0], y.shape[0]
+    if paired and nx != ny:
+        raise ValueError(f"A paired t-test needs two groups of the same size, the groups have {nx} and {ny} samples.")
+
+    mx, my = x.mean(axis=0), y.mean(axis=0)
+    vx, vy = x.var(axis=0, ddof=1), y.var(axis=0, ddof=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if paired:
+            dof = np.full(x.shape[1], nx - 1)
+            se = np.sqrt((x - y).var(axis=0, ddof=1) / nx)
+            d = (mx - my) / np.sqrt((vx + vy) / 2)
+            nc = d * np.sqrt(nx)
+        else:
+            if correction is True or (correction == "auto" and nx != ny):
+                # Welch separate variance T-test, dof from the Welch–Satterthwaite equation
+                vnx, vny = vx / nx, vy / ny
+                # undefined (NaN) without variance in both groups, like pingouin
+                dof = (vnx + vny) ** 2 / (vnx**2 / (nx - 1) + vny**2 / (ny - 1))
+                se = np.sqrt(vnx + vny)
+            else:
+                dof = np.full(x.shape[1], nx + ny - 2)
+                pooled = ((nx - 1) * vx + (ny - 1) * vy) / (nx + ny - 2)
+                se = np.sqrt(pooled * (1 / nx + 1 / ny))
+            d = (mx - my) / np.sqrt(((nx - 1) * vx + (ny - 1) * vy) / (nx + ny - 2))
+            nc = d / np.sqrt(1 / nx + 1 / ny)
+        t = (mx - my) / se
+
+        if alternative == "two-sided":
+            p = 2 * stats.t.sf(np.abs(t), dof)
+            tcrit = stats.t.ppf(1 - (1 - confidence) / 2, dof)
+        elif alternative == "greater":
+            p = stats.t.sf(t, dof)
+            tcrit = stats.t.ppf(confidence, dof)
+        else:
+            p = stats.t.cdf(t, dof)
+            tcrit = stats.t.ppf(confidence, dof)
+        ci = np.column_stack([(t - tcrit) * se, (t + tcrit) * se])
+        if alternative == "greater":
+            ci[:, 1] = np.inf
+        elif alternative == "less":
+            ci[:, 0] = -np.inf
+
+        # achieved power at alpha = 0.05, degrees of freedom of the Student T-test
+        power_dof = nx - 1 if paired else nx + ny - 2
+        if alternative == "two-sided":
+            nc = np.abs(nc)
+            power_tcrit = stats.t.ppf(1 - 0.05 / 2, power_dof)
+            # scipy returns NaN for the lower tail at large noncentrality, where it is ~0
+            lower = np.nan_to_num(stats.nct.cdf(-power_tcrit, power_dof, nc))
+            power = stats.nct.sf(power_tcrit, power_dof, nc) + lower
+        elif alternative == "greater":
+            power = stats.nct.sf(stats.t.ppf(1 - 0.05, power_dof), power_dof, nc)
+        else:
+            power = 1 - stats.nct.sf(stats.t.ppf(0.05, power_dof), power_dof, nc)
+
+    bf10 = bayesfactor_ttest(
+        t,
+        nx if paired else nx * ny / (nx + ny),
+        power_dof,
+        alternative,
+    )
+
+    return pd.DataFrame(
+        {
+            "T": t,
+            "dof": dof,
+            "alternative": alternative,
+            "p-val": p,
+            # rounded to two decimals like pingouin's default output
+            "CI%.0f%%" % (100 * confidence): list(np.round(ci, 2)),
+            "cohen-d": np.abs(d),
+            "BF10": [format_bf(bf) for bf in bf10],
+            "power": power,
+        },
+        index=pd.Index(columns, name="metabolite"),
+    )
+
+
+@profile
+@cache_data
+@store_results
+def gen_ttest_data(dataset, attribute, target_groups, paired, alternative, correction, p_correction):
+    # the page passes the Welch correction option as a string
+    correction = {"True": True, "False": False}.get(correction, correction)
+    rows = dataset.group_rows[attribute]
+    ttest = get_ttest_data(
+        dataset.X[rows[target_groups[0]]],
+        dataset.X[rows[target_groups[1]]],
+        dataset.features,
+        paired,
+        alternative,
+        correction,
+    )
+    # features without a test result, the other columns (e.g. power) never remove a feature
+    ttest = ttest.dropna(subset=["T", "p-val"])
 
     ttest.insert(8, "p-corrected", pg.multicomp(ttest["p-val"].astype(float), method=p_correction)[1])
     # add significance
     ttest.insert(9, "significance", ttest["p-corrected"] < 0.05)
-    ttest.insert(10, "st.session_state.ttest_attribute", ttest_attribute)
+    ttest.insert(10, "st.session_state.ttest_attribute", attribute)
     ttest.insert(11, "A", target_groups[0])
     ttest.insert(12, "B", target_groups[1])
 
     return ttest.sort_values("p-corrected")
 
 
-@st.cache_resource
+@profile
+@cache_resource
 def plot_ttest(df):
     fig = px.scatter(
         x=df["T"],
@@ -74,22 +203,12 @@ def plot_ttest(df):
     return fig
 
 
-@st.cache_resource
-def ttest_boxplot(df_ttest, metabolite):
-    df = pd.concat([st.session_state.md, st.session_state.data], axis=1)
-    df1 = pd.DataFrame(
-        {
-            metabolite: df[df[st.session_state.ttest_attribute] == st.session_state.ttest_options[0]].loc[:, metabolite],
-            "option": st.session_state.ttest_options[0],
-        }
-    )
-    df2 = pd.DataFrame(
-        {
-            metabolite: df[df[st.session_state.ttest_attribute] == st.session_state.ttest_options[1]].loc[:, metabolite],
-            "option": st.session_state.ttest_options[1],
-        }
-    )
-    df = pd.concat([df1, df2])
+@profile
+@cache_resource
+def ttest_boxplot(dataset, df_ttest, metabolite):
+    # attribute and the two groups are taken from the result table
+    attribute, a, b = df_ttest.iloc[0, 10:13]
+    df = dataset.get_feature(attribute, metabolite, [a, b]).rename(columns={attribute: "option"})
     fig = px.box(
         df,
         x="option",
@@ -101,7 +220,7 @@ def ttest_boxplot(df_ttest, metabolite):
     )
     fig.update_layout(
         showlegend=False,
-        xaxis_title=st.session_state.ttest_attribute.replace("st.session_state.ttest_attribute_", ""),
+        xaxis_title=attribute,
         yaxis_title="intensity",
         template="plotly_white",
         font={"color": "grey", "size": 12, "family": "Sans"},
@@ -126,7 +245,7 @@ def ttest_boxplot(df_ttest, metabolite):
     if isinstance(df["option"][0], str) and isinstance(df["option"][1], str):
         x0, x1 = 0, 1
     else:
-        x0, x1 = st.session_state.ttest_options[0], st.session_state.ttest_options[1]
+        x0, x1 = a, b
     # horizontal line
     fig.add_shape(
         type="line",
@@ -1,6 +1,7 @@
 import pandas as pd
 import streamlit as st
 import io
+from .common import get_metabolite_index
 
 ####################
 ### common text ####
@@ -83,17 +84,13 @@ def get_new_index(df):
         column_names = [col[0] for col in cols if col]
         if not column_names:
             return df, "no matching columns"
-        # set metabolites column with index as default
-        df["metabolite"] = df.index
+        # metabolite names from m/z and RT (and row ID), keep the index otherwise
         if len(column_names) == 2:
-            df["metabolite"] = df[column_names[0]].round(5).astype(str)
-            if column_names[1]:
-                df["metabolite"] = (
-                    df["metabolite"] + "@" + df[column_names[1]].round(2).astype(str)
-                )
-            if "row ID" in df.columns:
-                df["metabolite"] = df["row ID"].astype(str) + "_" + df["metabolite"]
-        df.set_index("metabolite", inplace=True)
+            df.index = get_metabolite_index(
+                df[column_names[0]], df[column_names[1]], df["row ID"] if "row ID" in df.columns else None
+            )
+        else:
+            df.index.name = "metabolite"
     except:
         return df, "fail"
     return df, "success"
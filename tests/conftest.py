@@ -0,0 +1,31 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# run from the repository root like the app, src is imported as a package
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from src import diskcache
+from src.common import get_metabolite_index
+
+
+@pytest.fixture(autouse=True)
+def result_store(tmp_path, monkeypatch):
+    # keep results of the tests out of the result store of the app
+    monkeypatch.setattr(diskcache, "RESULT_CACHE_DIR", tmp_path / "results")
+    monkeypatch.setattr(diskcache, "RESULT_INDEX", tmp_path / "results" / "index.sqlite")
+
+
+@pytest.fixture(scope="session")
+def example_data():
+    """Peak areas of the example feature table (samples x features) with one constant feature and the meta data."""
+    ft = pd.read_csv(ROOT / "example-data" / "FeatureMatrix.csv")
+    ft.index = get_metabolite_index(ft["row m/z"], ft["row retention time"], ft["row ID"])
+    data = ft[[c for c in ft.columns if c.endswith(" Peak area")]].T
+    data.index = data.index.str.replace(" Peak area", "")
+    data["constant"] = 1.0
+    md = pd.read_csv(ROOT / "example-data" / "MetaData.txt", sep="\t").set_index("filename")
+    return data.loc[md.index], md
@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pingouin as pg
+import pytest
+import scipy.stats as stats
+
+from src.dataset import AnalysisDataset
+from src.anova import anova, get_tukey_data, studentized_range_sf, tukey
+
+
+def pingouin_anova(data, md, attribute):
+    # the previous implementation, one pg.anova call per feature
+    df = pd.concat([data, md[attribute]], axis=1)
+    rows = []
+    for col in data.columns:
+        result = pg.anova(data=df, dv=col, between=attribute, detailed=True).set_index("Source")
+        # pg.anova returns no F (and p) for features without variance, p-unc is p_unc in newer pingouin
+        p = result.get("p-unc", result.get("p_unc", {}))
+        rows.append((col, p.get(attribute, np.nan), result.get("F", {}).get(attribute, np.nan)))
+    return pd.DataFrame(rows, columns=["metabolite", "p", "F"]).set_index("metabolite")
+
+
+@pytest.mark.parametrize("attribute", ["Sample", "Time-Point"])
+def test_anova_matches_pingouin(example_data, attribute):
+    data, md = example_data
+    result = anova(AnalysisDataset(data, md), attribute, "fdr_bh")
+    expected = pingouin_anova(data, md, attribute).dropna()
+    expected["p-corrected"] = pg.multicomp(expected["p"].to_numpy(), method="fdr_bh")[1]
+
+    assert "constant" not in result.index
+    assert sorted(result.index) == sorted(expected.index)
+    result = result.loc[expected.index]
+    for col in ["F", "p", "p-corrected"]:
+        np.testing.assert_allclose(result[col], expected[col], rtol=1e-5, err_msg=col)
+
+
+@pytest.mark.parametrize("k, df", [(2, 10), (4, 8), (5, 60), (12, 300)])
+def test_studentized_range_sf_matches_scipy(k, df):
+    q = np.linspace(0, 20, 201)
+    expected = stats.studentized_range.sf(q, k, df)
+    # p-values below about 1e-12 are set to zero, they are compared absolutely
+    np.testing.assert_allclose(studentized_range_sf(q, k, df), expected, rtol=1e-4, atol=1e-11)
+
+
+def test_tukey_matches_scipy(example_data):
+    data, md = example_data
+    # without the single PPL sample, the first 50 features (scipy needs a second per feature)
+    groups = ["A15M", "A45M", "A5M", "M"]
+    dataset = AnalysisDataset(data.iloc[:, :50], md)
+    result = get_tukey_data(*dataset.select("Sample", groups), dataset.features)
+
+    for metabolite, rows in result.groupby("stats_metabolite", sort=False):
+        values = [data.loc[md["Sample"] == group, metabolite].to_numpy() for group in groups]
+        expected = stats.tukey_hsd(*values)
+        a, b = [groups.index(g) for g in rows["A"]], [groups.index(g) for g in rows["B"]]
+        np.testing.assert_allclose(rows["diff"], expected.statistic[a, b], rtol=1e-5, err_msg=metabolite)
+        np.testing.assert_allclose(rows["stats_p"], expected.pvalue[a, b], rtol=1e-4, atol=1e-10, err_msg=metabolite)
+
+
+def test_tukey_without_degrees_of_freedom(example_data):
+    # every group has a single sample, no p-values like with pingouin, the rows are dropped
+    data, md = example_data
+    md = md.groupby("Sample").head(1)
+    dataset = AnalysisDataset(data.loc[md.index, data.columns[:20]], md)
+    assert np.isnan(get_tukey_data(*dataset.select("Sample"), dataset.features)["stats_p"]).all()
+    significant = pd.DataFrame({"significant": True}, index=dataset.features)
+    assert tukey(dataset, significant, "Sample", ["A5M", "M"], "fdr_bh").empty
@@ -0,0 +1,79 @@
+import numpy as np
+import pandas as pd
+import pingouin as pg
+import pytest
+import scikit_posthocs as sp
+import scipy.stats as stats
+
+from src.dataset import AnalysisDataset
+from src.kruskal import add_p_value_correction_to_dunns, dunn, get_dunn_data, get_kruskal_data, kruskal_wallis
+
+
+@pytest.fixture(scope="module")
+def example_dataset(example_data):
+    # the dataset keeps float32 intensities, compare on the same values
+    data, md = example_data
+    return data.astype(np.float32).astype(np.float64), md
+
+
+def test_kruskal_matches_scipy(example_dataset):
+    data, md = example_dataset
+    dataset = AnalysisDataset(data, md)
+    result = get_kruskal_data(*dataset.select("Sample"), dataset.features).set_index("metabolite")
+    groups = [data[md["Sample"] == group] for group in dataset.groups["Sample"]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        expected = np.array([tuple(stats.kruskal(*[g[col] for g in groups])) for col in data.columns])
+
+    # zero intensities are ties in most features, the constant feature has no result
+    assert (data == 0).sum().max() > 1
+    assert np.isnan(result.loc["constant", "statistic"])
+    np.testing.assert_allclose(result["statistic"], expected[:, 0], rtol=1e-5)
+    np.testing.assert_allclose(result["p"], expected[:, 1], rtol=1e-4, atol=1e-12)
+    assert "constant" not in kruskal_wallis(dataset, "Sample", "fdr_bh")["metabolite"].values
+
+
+def posthoc_dunn(data, md, attribute, groups):
+    # the previous implementation, one sp.posthoc_dunn call per feature, p-values for every pair
+    md = md[md[attribute].isin(groups)]
+    return {
+        col: sp.posthoc_dunn(pd.concat([data.loc[md.index, col], md[attribute]], axis=1), col, attribute, p_adjust=None)
+        for col in data.columns
+    }
+
+
+def test_dunn_all_pairs_matches_scikit_posthocs(example_dataset):
+    data, md = example_dataset
+    data = data.iloc[:, :100]
+    dataset = AnalysisDataset(data, md)
+    groups = dataset.groups["Sample"]
+    result = get_dunn_data(*dataset.select("Sample"), dataset.features)
+    expected = posthoc_dunn(data, md, "Sample", groups)
+
+    assert len(result) == len(data.columns) * len(groups) * (len(groups) - 1) // 2
+    expected_p = [expected[m].loc[a, b] for m, a, b in zip(result["stats_metabolite"], result["A"], result["B"])]
+    np.testing.assert_allclose(result["p"], expected_p, rtol=1e-4, atol=1e-12)
+
+    # the multiple testing correction works on the table of all pairs
+    corrected = add_p_value_correction_to_dunns(result.copy(), "fdr_bh")
+    np.testing.assert_allclose(
+        corrected.sort_index()["p-corrected"], pg.multicomp(result["p"].astype(float), method="fdr_bh")[1]
+    )
+    assert (corrected["stats_significant"] == (corrected["p-corrected"] < 0.05)).all()
+    assert corrected["p"].is_monotonic_increasing
+
+
+@pytest.mark.parametrize("pair", [["A5M", "M"], ["M", "A5M"]])
+def test_dunn_selected_pair_matches_scikit_posthocs(example_dataset, pair):
+    data, md = example_dataset
+    data = data.iloc[:, :200]
+    dataset = AnalysisDataset(data, md)
+    # few features are significant with three samples per group, test all of them
+    kruskal = pd.DataFrame({"metabolite": data.columns, "significant": True})
+    result = dunn(dataset, kruskal, "Sample", pair, "fdr_bh").set_index("stats_metabolite")
+    # ranks over the samples of the two groups only
+    expected = posthoc_dunn(data, md, "Sample", pair)
+    expected = pd.Series({m: p.loc[pair[0], pair[1]] for m, p in expected.items()}).dropna()
+
+    assert sorted(result.index) == sorted(expected.index)
+    assert (result["A"] == pair[0]).all() and (result["B"] == pair[1]).all()
+    np.testing.assert_allclose(result["p"], expected[result.index], rtol=1e-4)
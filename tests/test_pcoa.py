@@ -0,0 +1,81 @@
+import inspect
+
+import numpy as np
+import pandas as pd
+import pytest
+import skbio
+from scipy.spatial import distance
+
+from src.groupstats import encode_groups
+from src.pcoa import get_within_group_ss, permanova
+
+
+@pytest.fixture(scope="module")
+def random_distances():
+    """Bray-Curtis distances of 30 random samples in three groups with a small group effect."""
+    rng = np.random.default_rng(0)
+    features = rng.random((30, 50))
+    labels = pd.Series(np.repeat(["a", "b", "c"], 10))
+    features[labels == "a"] += 0.08
+    return distance.squareform(distance.pdist(features, "braycurtis")), labels
+
+
+@pytest.mark.parametrize("early_stopping", [False, True])
+def test_permanova_independent_of_n_jobs(random_distances, early_stopping):
+    D, labels = random_distances
+    results = [permanova(D, labels, seed=1, n_jobs=n_jobs, early_stopping=early_stopping) for n_jobs in [1, 2, 8, 16]]
+    for result in results[1:]:
+        pd.testing.assert_series_equal(result, results[0])
+    if early_stopping:
+        assert results[0]["number of permutations"] < 999
+
+
+def loop_pseudo_f(D, codes):
+    # PERMANOVA pseudo-F and R2 from the sums of squared distances within groups (Anderson 2001)
+    n, k = len(codes), codes.max() + 1
+    ss_total = sum(D[i, j] ** 2 for i in range(n) for j in range(i + 1, n)) / n
+    ss_within = 0
+    for group in range(k):
+        members = np.flatnonzero(codes == group)
+        ss_within += sum(D[i, j] ** 2 for i in members for j in members if i < j) / len(members)
+    return ((ss_total - ss_within) / (k - 1)) / (ss_within / (n - k)), 1 - ss_within / ss_total
+
+
+@pytest.fixture(scope="module")
+def example_distances(example_data):
+    data, md = example_data
+    return distance.squareform(distance.pdist(data.to_numpy(), "braycurtis")), md["Sample"]
+
+
+def test_pseudo_f_of_permutations(example_distances):
+    D, labels = example_distances
+    codes, groups = encode_groups(labels)
+    rng = np.random.default_rng(0)
+    permuted = rng.permuted(np.tile(codes, (20, 1)), axis=1)
+    group_sizes = np.bincount(codes)
+    ss_total = (D**2).sum() / (2 * len(codes))
+    ss_within = get_within_group_ss(D**2, permuted, group_sizes)
+    f = ((ss_total - ss_within) / (len(groups) - 1)) / (ss_within / (len(codes) - len(groups)))
+    np.testing.assert_allclose(f, [loop_pseudo_f(D, p)[0] for p in permuted], rtol=1e-10)
+
+
+@pytest.mark.parametrize("shuffle", [False, True])
+def test_permanova_matches_skbio(example_distances, shuffle):
+    D, labels = example_distances
+    if shuffle:
+        # without group effect, for a p-value far from the smallest possible one
+        labels = labels.sample(frac=1, random_state=0).set_axis(labels.index)
+    result = permanova(D, labels, permutations=999, seed=0)
+    # scikit-bio < 0.6 has no seed argument and permutes with the global numpy generator
+    np.random.seed(0)
+    seed = {"seed": 0} if "seed" in inspect.signature(skbio.stats.distance.permanova).parameters else {}
+    expected = skbio.stats.distance.permanova(skbio.DistanceMatrix(D), labels.to_numpy(), permutations=999, **seed)
+    f, r2 = loop_pseudo_f(D, encode_groups(labels)[0])
+
+    assert result["sample size"] == expected["sample size"]
+    assert result["number of groups"] == expected["number of groups"]
+    assert result["number of permutations"] == 999
+    np.testing.assert_allclose(result["test statistic"], expected["test statistic"], rtol=1e-10)
+    np.testing.assert_allclose([result["test statistic"], result["R2"]], [f, r2], rtol=1e-10)
+    # different random permutations, the p-values agree within about 3 standard errors
+    assert abs(result["p-value"] - expected["p-value"]) < 0.07
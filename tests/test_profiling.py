@@ -0,0 +1,29 @@
+import tracemalloc
+from types import SimpleNamespace
+
+from src import profiling
+
+
+def test_tracing_stops_for_disconnected_sessions(monkeypatch):
+    active_sessions = {"a", "b"}
+    monkeypatch.setattr(profiling.runtime, "exists", lambda: True)
+    monkeypatch.setattr(
+        profiling.runtime, "get_instance", lambda: SimpleNamespace(is_active_session=active_sessions.__contains__)
+    )
+
+    def set_tracing(session_id, enabled):
+        monkeypatch.setattr(profiling, "get_script_run_ctx", lambda: SimpleNamespace(session_id=session_id))
+        profiling.set_tracing(enabled)
+
+    try:
+        set_tracing("a", True)
+        set_tracing("b", False)
+        assert tracemalloc.is_tracing()
+        # session a disconnects without turning profiling off
+        active_sessions.discard("a")
+        set_tracing("b", False)
+        assert not tracemalloc.is_tracing()
+        assert not profiling._tracing_sessions
+    finally:
+        profiling._tracing_sessions.clear()
+        tracemalloc.stop()
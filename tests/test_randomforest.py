@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src import diskcache
+from src.dataset import AnalysisDataset
+from src.randomforest import get_oob_errors, run_random_forest_cv
+
+
+def fit_forest(features, labels, n_trees, **kwargs):
+    return RandomForestClassifier(n_estimators=n_trees, random_state=123, **kwargs).fit(features, labels)
+
+
+@pytest.mark.parametrize("n_samples", [4, 60])
+def test_oob_errors_match_refitted_forests(n_samples):
+    rng = np.random.default_rng(0)
+    features = rng.random((n_samples, 10))
+    labels = np.tile([1.0, 2.0], n_samples // 2)
+    tree_range = np.arange(1, 200, 10)
+    # the previous implementation, one forest with oob_score for every number of trees
+    expected = [1 - fit_forest(features, labels, n, oob_score=True).oob_score_ for n in tree_range]
+    errors = get_oob_errors(fit_forest(features, labels, tree_range[-1]), features, labels, tree_range)
+    np.testing.assert_allclose(errors, expected)
+
+
+def test_oob_errors_tiny_training_set():
+    # with 4 samples about 9% of the bootstrap samples contain all of them, no tree has OOB samples then
+    rng = np.random.default_rng(1)
+    features = rng.random((4, 10))
+    labels = np.array([1.0, 1.0, 2.0, 2.0])
+    rf = fit_forest(features, labels, 100)
+    assert any(np.isin(np.arange(4), in_bag).all() for in_bag in rf.estimators_samples_)
+    errors = get_oob_errors(rf, features, labels, range(1, 101))
+    assert len(errors) == 100
+
+
+def test_unseeded_runs_are_not_stored():
+    rng = np.random.default_rng(2)
+    samples = [f"s{i}" for i in range(12)]
+    data = pd.DataFrame(rng.random((12, 5)), index=samples, columns=[f"f{i}" for i in range(5)])
+    md = pd.DataFrame({"group": np.repeat(["a", "b"], 6)}, index=samples)
+    dataset = AnalysisDataset(data, md)
+    # the page draws a seed for unseeded runs and sets _store to False
+    run_random_forest_cv(dataset, "group", 5, 4242, 3, 1, _store=False)
+    run_random_forest_cv(dataset, "group", 5, None, 3, 1)
+    assert not list(diskcache.RESULT_CACHE_DIR.glob("*.parquet"))
+    run_random_forest_cv(dataset, "group", 5, 123, 3, 1)
+    assert list(diskcache.RESULT_CACHE_DIR.glob("*.parquet"))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+import scipy.stats as stats
+
+from src.testparametric import get_levene_data, get_shapiro_data
+
+
+def scipy_by_feature(test, groups, **kwargs):
+    # the previous implementation, one scipy call per feature
+    return np.array([tuple(test(*[g[:, j] for g in groups], **kwargs)) for j in range(groups[0].shape[1])])
+
+
+@pytest.mark.parametrize("n_samples", [3, 6, 13])
+def test_shapiro_matches_scipy(example_data, n_samples):
+    # covers the exact (n = 3), small sample (n <= 11) and large sample approximations
+    data, _ = example_data
+    X = data.iloc[:n_samples].to_numpy()
+    result = get_shapiro_data(X, data.columns)
+    expected = scipy_by_feature(stats.shapiro, [X])
+    np.testing.assert_allclose(result["W"], expected[:, 0], rtol=1e-5)
+    np.testing.assert_allclose(result["p"], expected[:, 1], rtol=1e-4, atol=1e-12)
+
+
+@pytest.mark.parametrize("center", ["median", "mean"])
+def test_levene_matches_scipy(example_data, center):
+    data, md = example_data
+    groups = ["A15M", "A45M", "A5M", "M"]
+    X = data[md["Sample"].isin(groups)].to_numpy()
+    codes = np.searchsorted(groups, md.loc[md["Sample"].isin(groups), "Sample"])
+    result = get_levene_data(X, codes, np.array(groups), data.columns, center)
+    expected = scipy_by_feature(stats.levene, [X[codes == i] for i in range(len(groups))], center=center)
+    np.testing.assert_allclose(result["W"], expected[:, 0], rtol=1e-6)
+    np.testing.assert_allclose(result["p"], expected[:, 1], rtol=1e-6)
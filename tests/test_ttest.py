@@ -0,0 +1,75 @@
+import numpy as np
+import pingouin as pg
+import pandas as pd
+import pytest
+
+from src.dataset import AnalysisDataset
+from src.ttest import bayesfactor_ttest, gen_ttest_data, get_ttest_data
+
+# newer pingouin versions use other column names
+PINGOUIN_COLUMNS = {"p_val": "p-val", "CI95": "CI95%", "cohen_d": "cohen-d"}
+
+
+def test_paired_ttest_needs_groups_of_equal_size():
+    rng = np.random.default_rng(0)
+    with pytest.raises(ValueError, match="same size"):
+        get_ttest_data(rng.random((5, 3)), rng.random((4, 3)), ["a", "b", "c"], True, "two-sided", "auto")
+
+
+def pingouin_bayesfactor(t, nx, ny, paired, alternative):
+    bf10 = pg.bayesfactor_ttest(t, nx, None if paired else ny, paired=paired)
+    # newer pingouin versions only compute two-sided Bayes factors, one-sided ones as in pingouin 0.5
+    if alternative != "two-sided":
+        bf10 *= 2
+        if (t < 0 if alternative == "greater" else t > 0) and bf10 > 1:
+            bf10 = 1 / bf10
+    return bf10
+
+
+@pytest.mark.parametrize("paired", [False, True])
+@pytest.mark.parametrize("alternative", ["two-sided", "greater", "less"])
+def test_bayesfactor_matches_pingouin(example_data, paired, alternative):
+    data, md = example_data
+    x = data[md["Sample"] == "A5M"].to_numpy()
+    y = data[md["Sample"] == "M"].to_numpy()
+    t = get_ttest_data(x, y, data.columns, paired, alternative, "auto")["T"].dropna().to_numpy()[:200]
+    nx, ny = len(x), len(y)
+    if paired:
+        bf10 = bayesfactor_ttest(t, nx, nx - 1, alternative)
+    else:
+        bf10 = bayesfactor_ttest(t, nx * ny / (nx + ny), nx + ny - 2, alternative)
+    expected = [pingouin_bayesfactor(value, nx, ny, paired, alternative) for value in t]
+    np.testing.assert_allclose(bf10, expected, rtol=1e-4)
+
+
+def pingouin_ttest(x, y, paired, alternative, correction):
+    # the previous implementation, one pg.ttest call per feature, rows with missing results were dropped
+    rows = [pg.ttest(x[col], y[col], paired, alternative, correction).assign(metabolite=col) for col in x.columns]
+    return pd.concat(rows).set_index("metabolite").rename(columns=PINGOUIN_COLUMNS).dropna(subset=["T", "p-val"])
+
+
+@pytest.mark.parametrize(
+    "paired, correction, groups",
+    [
+        (False, "auto", ["A5M", "M"]),
+        (False, True, ["A5M", "M"]),
+        (False, False, ["A5M", "M"]),
+        # unequal group sizes, auto uses the Welch test
+        (False, "auto", ["A5M", "M", "A45M"]),
+        (True, "auto", ["A5M", "M"]),
+    ],
+)
+@pytest.mark.parametrize("alternative", ["two-sided", "greater", "less"])
+def test_ttest_matches_pingouin(example_data, paired, correction, groups, alternative):
+    data, md = example_data
+    # the dataset keeps float32 intensities, compare on the same values
+    data = data.astype(np.float32).astype(np.float64)
+    md = md.assign(group=md["Sample"].map({groups[0]: "x", **{g: "y" for g in groups[1:]}}))
+    result = gen_ttest_data(AnalysisDataset(data, md), "group", ["x", "y"], paired, alternative, str(correction), "fdr_bh")
+    expected = pingouin_ttest(data[md["group"] == "x"], data[md["group"] == "y"], paired, alternative, correction)
+
+    assert sorted(result.index) == sorted(expected.index)
+    result = result.loc[expected.index]
+    for col in ["T", "dof", "p-val", "cohen-d", "power"]:
+        np.testing.assert_allclose(result[col].astype(float), expected[col].astype(float), rtol=1e-5, atol=1e-12, err_msg=col)
+    np.testing.assert_allclose(np.stack(result["CI95%"]), np.stack(expected["CI95%"]), rtol=1e-5, atol=0.01)